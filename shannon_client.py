@@ -0,0 +1,139 @@
+"""
+A load testing client for shannon_server.py. It opens a number of
+connections to the server, keeps up to `depth` requests in flight on each
+(pipelining), and prints the round trip latencies and throughput it saw
+along with the server's own counters.
+
+    python shannon_client.py CORPUS [--port PORT | --unix PATH]
+        [--connections N] [--requests N] [--depth N] [--play]
+
+Requests are made from phrases taken from evenly spaced places in CORPUS:
+PREDICT requests for two character contexts by default, or
+PLAY requests for whole phrases with --play.
+"""
+
+import asyncio
+import json
+import time
+
+from shannon_p2 import format_document
+
+
+def make_requests(corpus, n_requests, play=False, phrase_len=40):
+    """
+    Returns `n_requests` protocol lines made from `corpus`.
+
+    >>> make_requests('pitter patter', 3)
+    ['PREDICT 1 pi', 'PREDICT 1 te', 'PREDICT 1  p']
+    >>> make_requests('pitter patter', 2, play=True, phrase_len=6)
+    ['PLAY pitter', 'PLAY ter pa']
+    """
+    width = phrase_len if play else 2
+    step = max(1, (len(corpus) - width) // n_requests)
+    requests = []
+    for start in range(0, len(corpus) - width + 1, step)[:n_requests]:
+        text = corpus[start:start + width]
+        requests.append('PLAY ' + text if play else 'PREDICT 1 ' + text)
+    return requests
+
+
+async def _open(host, port, path):
+    if path is None:
+        return await asyncio.open_connection(host, port)
+    return await asyncio.open_unix_connection(path)
+
+
+async def run_connection(requests, host, port, path, depth):
+    """
+    Sends `requests` on one connection with up to `depth` in flight and
+    returns the round trip latency of each in seconds.
+    """
+    reader, writer = await _open(host, port, path)
+    sent_at = []
+    latencies = []
+    window = asyncio.Semaphore(depth)
+
+    async def send():
+        for request in requests:
+            await window.acquire()
+            sent_at.append(time.perf_counter())
+            writer.write(request.encode('utf-8') + b'\n')
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for _ in requests:
+        response = await reader.readline()
+        if not response.startswith(b'OK'):
+            raise RuntimeError('server said {!r}'.format(response))
+        latencies.append(time.perf_counter() - sent_at[len(latencies)])
+        window.release()
+    await sender
+    writer.close()
+    return latencies
+
+
+async def fetch_stats(host, port, path):
+    """Returns the server's STATS as a dict"""
+    reader, writer = await _open(host, port, path)
+    writer.write(b'STATS\n')
+    response = await reader.readline()
+    writer.close()
+    return json.loads(response[3:])
+
+
+async def load_test(requests, host='127.0.0.1', port=8765, path=None,
+                    connections=8, depth=32):
+    """
+    Spreads `requests` over `connections` concurrent connections and
+    returns (sorted latencies, seconds taken, server stats).
+    """
+    shares = [requests[start::connections] for start in range(connections)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_connection(share, host, port, path, depth) for share in shares))
+    time_taken = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result)
+    return latencies, time_taken, await fetch_stats(host, port, path)
+
+
+def report(latencies, time_taken, stats):
+    """Prints the results of load_test"""
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1,
+                             int(fraction * len(latencies)))]
+    print('{} requests in {:.3f} s: {:.0f} requests/s'.format(
+        len(latencies), time_taken, len(latencies) / time_taken))
+    print('round trip ms: p50 {:.3f}  p90 {:.3f}  p99 {:.3f}  max {:.3f}'
+          .format(percentile(0.5) * 1e3, percentile(0.9) * 1e3,
+                  percentile(0.99) * 1e3, latencies[-1] * 1e3))
+    print('Server')
+    for name, value in stats.items():
+        if isinstance(value, float):
+            value = '{:.6f}'.format(value)
+        print('{:>14}: {}'.format(name, value))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('corpus', help='the text to make requests from')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='connect to this Unix socket instead of TCP')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=32,
+                        help='requests in flight on each connection')
+    parser.add_argument('--play', action='store_true',
+                        help='send PLAY rather than PREDICT requests')
+    args = parser.parse_args()
+    with open(args.corpus) as infile:
+        corpus = format_document(infile.read())
+    requests = make_requests(corpus, args.requests, args.play)
+    report(*asyncio.run(load_test(requests, args.host, args.port, args.unix,
+                                  args.connections, args.depth)))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,10 +9,55 @@ import re
 import doctest
 import time
 import sys
+import os
+import mmap
+import struct
+import tracemalloc
+import hashlib
+import json
+import platform
+import random
+import codecs
+from array import array
+from fractions import Fraction
+from math import gcd
+from bisect import bisect_left
+from unicodedata import category
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # the bulk helpers fall back to pure Python
+    np = None
 
 
 DEFAULT_CORPUS = 'corpus.txt'
 
+TEST_PHRASES = ['dead war', 'through tough thorough thought though',
+                'Hello isn\'t it a lovely day today.']
+
+# Guessed, in this order, once the corpus has no more to suggest
+FALLBACKS = tuple([chr(c) for c in range(ord('a'), ord('z') + 1)] +
+                  [' ', ',', '.', "'", '"', ';', '!', '?'])
+
+TEST_FILES = ['the-yellow-wall-paper.txt', 'hamlet.txt', 'le-rire.txt',
+              'war-of-the-worlds.txt', 'ulysses.txt', 'war-and-peace.txt']
+
+# Number of precomputed hashes process_corpus unpacks into Python ints at once
+_HASH_BLOCK = 1 << 16
+
+# Bump whenever format_document's output changes, so cached models built
+# with the old output aren't reused
+NORMALIZER_VERSION = 1
+
+# http://www.unicode.org/reports/tr44/#General_Category_Values
+_ALLOWED_CATEGORIES = ('Lu', 'Ll', 'Lo', 'Po', 'Zs')
+
+_WHITESPACE = re.compile(r'\s+', re.UNICODE)
+_LEADING_WHITESPACE = re.compile(r'^\s+', re.UNICODE)
+_NON_ASCII = re.compile(rb'[\x80-\xff]')
+
 
 def _c_mul(num_a, num_b):
     '''Substitute for c multiply function'''
@@ -35,6 +80,41 @@ def nice_hash(input_string):
     return value
 
 
+def bulk_nice_hash(corpus, width=2):
+    """
+    Returns the nice_hash of every `width` character window of `corpus`, ie,
+    item i is nice_hash(corpus[i:i + width]).
+
+    With NumPy this is done for all windows at once using unsigned 32-bit
+    arithmetic, whose wraparound is exactly the masking done by _c_mul, and
+    a uint32 array is returned. Without NumPy the windows are hashed one at
+    a time into an array('I').
+
+    >>> hashes = bulk_nice_hash('pitter patter')
+    >>> len(hashes)
+    12
+    >>> hashes.tolist() == [nice_hash('pitter patter'[i:i + 2])
+    ...                     for i in range(12)]
+    True
+    >>> bulk_nice_hash('tea', 3).tolist() == [nice_hash('tea')]
+    True
+    >>> len(bulk_nice_hash('t'))
+    0
+    """
+    n_windows = max(0, len(corpus) - width + 1)
+    if np is None:
+        return array('I', (nice_hash(corpus[i:i + width])
+                           for i in range(n_windows)))
+    codes = np.frombuffer(corpus.encode('utf-32-le'), dtype='<u4')
+    codes = codes.astype(np.uint32)
+    value = codes[:n_windows] << np.uint32(7)
+    for offset in range(width):
+        value *= np.uint32(1000003)
+        value ^= codes[offset:offset + n_windows]
+    value ^= np.uint32(width)
+    return value
+
+
 class Frequency(object):
     """
     Stores a letter:frequency pair.
@@ -49,10 +129,13 @@ class Frequency(object):
     <'c': 2>
     """
 
+    __slots__ = ('letter', 'frequency', 'next', 'prev')
+
     def __init__(self, letter, frequency):
         self.letter = letter
         self.frequency = frequency
         self.next = None
+        self.prev = None
 
     def __repr__(self):
         return ('<' +
@@ -64,34 +147,81 @@ class SortedFrequencyList(object):
     """
     Stores a collection of Frequency objects as a sorted linked list.
     Items are sorted from the highest frequency to the lowest.
+
+    The list is doubly linked and indexed two ways so that the common
+    operations don't have to walk it:
+      `_index` maps each letter to its Frequency node, and
+      `_bucket_heads` maps each frequency to the first node holding it.
+    Nodes with the same frequency are always contiguous, so the node before
+    a bucket's head is the last node of the next higher bucket. Moving a
+    node up therefore only hops from bucket to bucket, which is a single
+    hop for the usual increment of one.
     """
 
+    __slots__ = ('head', 'tail', '_index', '_bucket_heads')
+
     def __init__(self):
         self.head = None
+        self.tail = None
+        self._index = {}
+        self._bucket_heads = {}
 
-    def move_node_to_place(self, freq_node):
-        """Scans through the linked list and adds
-        the freq_node into the correct place based on its frequency
+    def _unlink(self, freq_node):
+        """Detaches freq_node from the list, keeping the buckets valid"""
+        frequency = freq_node.frequency
+        if self._bucket_heads.get(frequency) is freq_node:
+            following = freq_node.next
+            if following is not None and following.frequency == frequency:
+                self._bucket_heads[frequency] = following
+            else:
+                del self._bucket_heads[frequency]
+        if freq_node.prev is None:
+            self.head = freq_node.next
+        else:
+            freq_node.prev.next = freq_node.next
+        if freq_node.next is None:
+            self.tail = freq_node.prev
+        else:
+            freq_node.next.prev = freq_node.prev
+        freq_node.next = None
+        freq_node.prev = None
+
+    def _insert_after(self, previous, freq_node):
+        """Links freq_node in directly after `previous` (or at the head if
+        `previous` is None). The caller must pick a `previous` that keeps
+        the list sorted.
         """
-        freq_of_letter = freq_node.frequency  
-        current = self.head
-        added = False
-            
-        if freq_of_letter > self.head.frequency:
+        freq_node.prev = previous
+        if previous is None:
             freq_node.next = self.head
             self.head = freq_node
-            added = True
+        else:
+            freq_node.next = previous.next
+            previous.next = freq_node
+        if freq_node.next is None:
+            self.tail = freq_node
+        else:
+            freq_node.next.prev = freq_node
+        if previous is None or previous.frequency != freq_node.frequency:
+            self._bucket_heads[freq_node.frequency] = freq_node
+
+    def _last_at_least(self, start, frequency):
+        """Returns the last node with a frequency of at least `frequency`,
+        searching upwards from `start`, which must be the last node of its
+        bucket (or None). Returns None if every node is lower.
+        """
+        current = start
+        while current is not None and current.frequency < frequency:
+            current = self._bucket_heads[current.frequency].prev
+        return current
+
+    def move_node_to_place(self, freq_node):
+        """Adds the (unlinked) freq_node into the correct place based on its
+        frequency, ie, after all items with the same or greater frequency.
+        """
+        previous = self._last_at_least(self.tail, freq_node.frequency)
+        self._insert_after(previous, freq_node)
 
-        while current.next is not None and not added:
-            if freq_of_letter > current.next.frequency:
-                freq_node.next = current.next
-                current.next = freq_node
-                added = True
-            else:
-                current = current.next
-        if not added:
-            current.next = freq_node
-                    
     def add(self, letter, frequency=1):
         """
         Adds the given letter and frequency combination as a Frequency object
@@ -152,30 +282,27 @@ class SortedFrequencyList(object):
         SFL(<'a': 6>, <'c': 2>, <'r': 2>)
         
         """
-        current = self.head
-        previous = self.head
-        stop = False
-        temp = Frequency(letter, frequency)
-        
-        while current is not None and not stop:
-            if current.letter == letter:
-                current.frequency += frequency                   
-                if current.frequency > previous.frequency:
-                    previous.next = current.next
-                    self.move_node_to_place(current)
-                stop = True
-            else:
-                previous = current
-                current = current.next
-                
-        if stop is False:
-            if previous is not None:
-                if frequency > 1:
-                    self.move_node_to_place(temp)
-                else:
-                    previous.next = temp
-            else:
-                self.head = temp      
+        current = self._index.get(letter)
+        if current is None:
+            temp = Frequency(letter, frequency)
+            self._index[letter] = temp
+            self.move_node_to_place(temp)
+            return
+        if frequency <= 0:
+            self._unlink(current)
+            current.frequency += frequency
+            self.move_node_to_place(current)
+            return
+        # The search starts from the end of the bucket above the node's one
+        bucket_head = self._bucket_heads[current.frequency]
+        if bucket_head is current:
+            start = current.prev
+        else:
+            start = bucket_head.prev
+        self._unlink(current)
+        current.frequency += frequency
+        self._insert_after(self._last_at_least(start, current.frequency),
+                           current)
 
     def remove(self, letter):
         """
@@ -204,18 +331,11 @@ class SortedFrequencyList(object):
         True
         >>> f
         SFL()
+        >>> f.remove('a')
         """
-        if self.head.letter == letter:
-            self.head = self.head.next
-            return
-        current_node = self.head
-        previous_node = None
-        while current_node != None:
-            if current_node.letter == letter:
-                previous_node.next = current_node.next
-                return
-            previous_node = current_node
-            current_node = current_node.next      
+        freq_node = self._index.pop(letter, None)
+        if freq_node is not None:
+            self._unlink(freq_node)
 
     def find(self, letter):
         """
@@ -237,20 +357,52 @@ class SortedFrequencyList(object):
         >>> f.find('e')
         <'e': 4>
         """
+        return self._index.get(letter)
 
-        current_node = self.head
-        while current_node != None:
-            if current_node.letter == letter:
-                return current_node
-            current_node = current_node.next
-        return None        
+    def __contains__(self, item):
+        return item in self._index
 
+    def __len__(self):
+        return len(self._index)
 
-    def __contains__(self, item):
-        # you should use the find method here
+    def items(self):
+        """ Yields (letter, frequency) pairs from highest to lowest frequency
+        """
+        current = self.head
+        while current is not None:
+            yield current.letter, current.frequency
+            current = current.next
 
-        return self.find(item) is not None
+    def merge(self, other):
+        """
+        Adds every letter and frequency in the SortedFrequencyList `other` to
+        this list, in `other`'s order, following the same rules as add.
+
+        >>> f = SortedFrequencyList()
+        >>> f.add('a', 3)
+        >>> f.add('b', 1)
+        >>> g = SortedFrequencyList()
+        >>> g.add('c', 2)
+        >>> g.add('b', 2)
+        >>> f.merge(g)
+        >>> f
+        SFL(<'a': 3>, <'b': 3>, <'c': 2>)
+        >>> g
+        SFL(<'c': 2>, <'b': 2>)
+        """
+        for letter, frequency in other.items():
+            self.add(letter, frequency)
+
+    def __getstate__(self):
+        # Pickling the nodes themselves recurses once per node
+        return list(self.items())
 
+    def __setstate__(self, state):
+        SortedFrequencyList.__init__(self)
+        for letter, frequency in state:
+            temp = Frequency(letter, frequency)
+            self._index[letter] = temp
+            self._insert_after(self.tail, temp)
 
     def __iter__(self):
         """ Returns a simple list of Frequency items
@@ -272,6 +424,57 @@ class SortedFrequencyList(object):
         return 'SFL(' + ', '.join(item_strs) + ')'
 
 
+class TopKFrequencyList(SortedFrequencyList):
+    """
+    A SortedFrequencyList that holds at most `capacity` letters, keeping
+    approximately the most frequent ones with the Space-Saving algorithm:
+    a new letter arriving when the list is full replaces the last (least
+    frequent) letter and takes over its frequency, plus its own.
+    Frequencies can therefore be overestimated, by at most the frequency
+    of the last letter, but any letter whose true frequency is higher than
+    that is always kept.
+
+    >>> f = TopKFrequencyList(2)
+    >>> for letter in 'aab':
+    ...     f.add(letter)
+    >>> f
+    SFL(<'a': 2>, <'b': 1>)
+    >>> f.add('c')
+    >>> f
+    SFL(<'a': 2>, <'c': 2>)
+    >>> print(f.find('b'))
+    None
+    """
+
+    __slots__ = ('capacity',)
+
+    def __init__(self, capacity):
+        """Initialises an empty list holding at most `capacity` letters"""
+        super().__init__()
+        self.capacity = capacity
+
+    def add(self, letter, frequency=1):
+        """
+        Adds the given letter and frequency as SortedFrequencyList.add does,
+        first evicting the last letter if `letter` is new and the list is
+        full.
+        """
+        if (frequency > 0 and letter not in self._index and
+                len(self._index) >= self.capacity):
+            evicted = self.tail
+            self.remove(evicted.letter)
+            frequency += evicted.frequency
+        super().add(letter, frequency)
+
+    def __getstate__(self):
+        return self.capacity, list(self.items())
+
+    def __setstate__(self, state):
+        capacity, items = state
+        super().__setstate__(items)
+        self.capacity = capacity
+
+
 
 class PrefixItem(object):
     """
@@ -284,6 +487,8 @@ class PrefixItem(object):
     PfI('th': SFL(<'e': 40>, <'o': 10>))
     """
 
+    __slots__ = ('prefix', 'possibles')
+
     def __init__(self, prefix, possibles):
         """
         Initialises a new PrefixItem with the given letter `prefix` and
@@ -305,6 +510,14 @@ class PrefixTable(object):
     PrefixItems internally.
     """
 
+    # Number of characters of context each prefix holds
+    prefix_len = 2
+    # The last prefix_len characters of the corpus the table was built from,
+    # which give the context for the first characters of any text added
+    tail = ''
+    # The most followers kept for each prefix, or None to keep them all
+    top_k = None
+
     def __init__(self, slots):
         """
         Initialises the PrefixTable with a number of `slots`. The table cannot
@@ -314,13 +527,14 @@ class PrefixTable(object):
         self.n_slots = slots
         self.n_items = 0
 
-    def store(self, prefix, possibles):
+    def store(self, prefix, possibles, hash_value=None):
         """
         Stores the given letter `prefix` and list of `possibles` (a
         SortedFrequencyList) in the hash table using a PrefixItem. If the
         item is successfully stored in the table, this method returns
         True, otherwise (for example, if there is no more room left in the
         table) it returns False.
+        `hash_value` may be given if nice_hash(prefix) is already known.
 
         >>> p = PrefixTable(1)
         >>> p.store('th', SortedFrequencyList())
@@ -351,7 +565,9 @@ class PrefixTable(object):
         if self.n_slots == self.n_items:
             return False
         prefix_pair = PrefixItem(prefix, possibles)
-        index = nice_hash(prefix) % self.n_slots
+        if hash_value is None:
+            hash_value = nice_hash(prefix)
+        index = hash_value % self.n_slots
         while self.data[index] is not None:
             index += 1
             if index == self.n_slots:
@@ -360,10 +576,11 @@ class PrefixTable(object):
         self.n_items += 1
         return True
 
-    def fetch(self, prefix):
+    def fetch(self, prefix, hash_value=None):
         """"
         Returns the SortedFrequencyList of possibles associated with the given
         letter `prefix', or None if the `prefix` isn't stored in the table.
+        `hash_value` may be given if nice_hash(prefix) is already known.
 
         >>> prefix = 'th'
         >>> possibles = SortedFrequencyList()
@@ -394,9 +611,14 @@ class PrefixTable(object):
         SFL(<'r': 30>, <'w': 20>)
         >>> print(t.fetch('rr'))
         None
+        >>> print(t.fetch(''))
+        None
         """
-
-        index = nice_hash(prefix) % self.n_slots
+        if hash_value is None:
+            if not prefix:
+                return None
+            hash_value = nice_hash(prefix)
+        index = hash_value % self.n_slots
         for _ in range(0, self.n_slots):
             table_pos = self.data[index]       
             if table_pos is None or table_pos.prefix != prefix:
@@ -413,6 +635,51 @@ class PrefixTable(object):
 
         return self.fetch(prefix) is not None
 
+    def _probe_length(self, prefix, hash_value=None):
+        """Returns the number of slots fetch looks at to find `prefix`"""
+        if hash_value is None:
+            if not prefix:
+                return 0
+            hash_value = nice_hash(prefix)
+        index = hash_value % self.n_slots
+        for probes in range(1, self.n_slots + 1):
+            item = self.data[index]
+            if item is not None and item.prefix == prefix:
+                return probes
+            index = (index + 1) % self.n_slots
+        return self.n_slots
+
+    def items(self):
+        """ Yields (prefix, possibles) for each item in slot order """
+        for item in self.data:
+            if item is not None and item is not _DELETED:
+                yield item.prefix, item.possibles
+
+    def merge(self, other):
+        """
+        Adds the possibles of every prefix in the table `other` to this
+        table using SortedFrequencyList.merge. Prefixes this table doesn't
+        have yet are stored with a copy of `other`'s list, so the two tables
+        never share a list. Raises ValueError if this table runs out of room.
+
+        >>> a = process_corpus('pitter patter', None, growable=True)
+        >>> b = process_corpus('patter potter', None, growable=True)
+        >>> a.merge(b)
+        >>> a.fetch('tt')
+        SFL(<'e': 4>)
+        >>> a.fetch(' p')
+        SFL(<'a': 1>, <'o': 1>)
+        >>> a.fetch('ot')
+        SFL(<'t': 1>)
+        """
+        for prefix, possibles in other.items():
+            mine = self.fetch(prefix)
+            if mine is None:
+                mine = SortedFrequencyList()
+                if not self.store(prefix, mine):
+                    raise ValueError('PrefixTable is full')
+            mine.merge(possibles)
+
 
     def __repr__(self):
         ans = 'Prefix hash Table\n'
@@ -423,7 +690,289 @@ class PrefixTable(object):
 
 
 
-def process_corpus(corpus, unique_chars):
+class _Deleted(object):
+    """Tombstone left in a GrowablePrefixTable slot by delete()"""
+
+    prefix = None
+
+    def __repr__(self):
+        return 'Deleted'
+
+
+_DELETED = _Deleted()
+
+
+class GrowablePrefixTable(PrefixTable):
+    """
+    A PrefixTable that starts small and doubles its number of slots whenever
+    the proportion of used slots (items plus tombstones) would pass
+    `max_load`, so its size follows the number of prefixes actually stored.
+
+    Collisions are resolved with Robin Hood hashing: while probing for a
+    free slot, an item that is further from its home slot than the resident
+    takes the resident's place and the resident carries on probing. This
+    keeps every probe sequence short, and the longest one is remembered so
+    lookups never probe further than that. Deleted items are replaced by a
+    tombstone that later insertions can reuse.
+
+    >>> t = GrowablePrefixTable(2)
+    >>> for pair in ('th', 'he', 'e ', ' q', 'qu'):
+    ...     t.store(pair, SortedFrequencyList())
+    True
+    True
+    True
+    True
+    True
+    >>> t.n_slots, t.n_items
+    (8, 5)
+    >>> t.fetch('he')
+    SFL()
+    >>> t.delete('he')
+    True
+    >>> t.delete('he')
+    False
+    >>> print(t.fetch('he'))
+    None
+    >>> t
+    Prefix hash Table
+    -----------------
+        0: PfI('e ': SFL())
+        1: PfI('qu': SFL())
+        2: Deleted
+        3: PfI(' q': SFL())
+        4: PfI('th': SFL())
+        5: None
+        6: None
+        7: None
+    """
+
+    def __init__(self, slots=8, max_load=0.75):
+        """
+        Initialises an empty table with `slots` slots (rounded up to a power
+        of two) that grows once more than `max_load` of its slots are in use.
+        """
+        if not 0 < max_load < 1:
+            raise ValueError('max_load must be between 0 and 1')
+        bits = max(1, slots - 1).bit_length()
+        super().__init__(1 << bits)
+        self._shift = 32 - bits
+        self.max_load = max_load
+        self.n_deleted = 0
+        self.max_probe = 0
+        self._hashes = [0] * self.n_slots
+
+    def _home(self, hash_value):
+        """Returns the slot `hash_value` belongs in.
+        nice_hash values of short strings differ mostly in their low bits,
+        so they are scrambled with a Fibonacci multiplier and the top bits
+        used instead of simply taking the remainder.
+        """
+        return _c_mul(hash_value, 0x9E3779B1) >> self._shift
+
+    def _find(self, prefix, hash_value):
+        """Returns the slot holding `prefix`, or None"""
+        index = self._home(hash_value)
+        for _ in range(self.max_probe + 1):
+            item = self.data[index]
+            if item is None:
+                return None
+            if self._hashes[index] == hash_value and item.prefix == prefix:
+                return index
+            index += 1
+            if index == self.n_slots:
+                index = 0
+        return None
+
+    def _insert(self, item, hash_value):
+        """Places `item`, which mustn't already be in the table"""
+        index = self._home(hash_value)
+        distance = 0
+        while True:
+            resident = self.data[index]
+            if resident is None or resident is _DELETED:
+                if resident is _DELETED:
+                    self.n_deleted -= 1
+                self.data[index] = item
+                self._hashes[index] = hash_value
+                self.n_items += 1
+                self.max_probe = max(self.max_probe, distance)
+                return
+            resident_distance = ((index - self._home(self._hashes[index]))
+                                 % self.n_slots)
+            if resident_distance < distance:
+                self.data[index] = item
+                self.max_probe = max(self.max_probe, distance)
+                item = resident
+                hash_value, self._hashes[index] = (self._hashes[index],
+                                                   hash_value)
+                distance = resident_distance
+            index += 1
+            distance += 1
+            if index == self.n_slots:
+                index = 0
+
+    def _resize(self, slots):
+        """Rehashes every item into a new array of `slots` slots, which
+        also clears out the tombstones.
+        """
+        old_items = [(item, hash_value)
+                     for item, hash_value in zip(self.data, self._hashes)
+                     if item is not None and item is not _DELETED]
+        self.data = [None] * slots
+        self._hashes = [0] * slots
+        self.n_slots = slots
+        self._shift = 32 - (slots - 1).bit_length()
+        self.n_items = 0
+        self.n_deleted = 0
+        self.max_probe = 0
+        for item, hash_value in old_items:
+            self._insert(item, hash_value)
+
+    def store(self, prefix, possibles, hash_value=None):
+        """
+        Stores the given letter `prefix` and list of `possibles`, replacing
+        any possibles already stored for `prefix`. Always returns True, as
+        the table grows to make room.
+        """
+        if hash_value is None:
+            hash_value = nice_hash(prefix)
+        index = self._find(prefix, hash_value)
+        if index is not None:
+            self.data[index] = PrefixItem(prefix, possibles)
+            return True
+        if self.n_items + self.n_deleted + 1 > self.max_load * self.n_slots:
+            if self.n_items + 1 > self.max_load * self.n_slots / 2:
+                self._resize(self.n_slots * 2)
+            else:
+                self._resize(self.n_slots)
+        self._insert(PrefixItem(prefix, possibles), hash_value)
+        return True
+
+    def fetch(self, prefix, hash_value=None):
+        """
+        Returns the SortedFrequencyList of possibles associated with the given
+        letter `prefix', or None if the `prefix` isn't stored in the table.
+        """
+        if hash_value is None:
+            if not prefix:
+                return None
+            hash_value = nice_hash(prefix)
+        index = self._find(prefix, hash_value)
+        if index is None:
+            return None
+        return self.data[index].possibles
+
+    def _probe_length(self, prefix, hash_value=None):
+        """Returns the number of slots fetch looks at to find `prefix`"""
+        if hash_value is None:
+            if not prefix:
+                return 0
+            hash_value = nice_hash(prefix)
+        index = self._home(hash_value)
+        for probes in range(1, self.max_probe + 2):
+            item = self.data[index]
+            if item is None or (self._hashes[index] == hash_value and
+                                item.prefix == prefix):
+                return probes
+            index = (index + 1) & (self.n_slots - 1)
+        return self.max_probe + 1
+
+    def delete(self, prefix):
+        """
+        Removes `prefix` from the table, leaving a tombstone in its slot.
+        Returns True if it was there, otherwise False.
+        """
+        index = self._find(prefix, nice_hash(prefix))
+        if index is None:
+            return False
+        self.data[index] = _DELETED
+        self.n_items -= 1
+        self.n_deleted += 1
+        return True
+
+
+
+def _store_ranked(table, ranked):
+    """
+    Stores each (pair, [(letter, count), ...]) from `ranked` in `table` with
+    a SortedFrequencyList holding the letters in the order given, and returns
+    `table`.
+    """
+    for pair, followers in ranked:
+        possibles = SortedFrequencyList()
+        for letter, count in followers:
+            possibles.add(letter, count)
+        table.store(pair, possibles)
+    return table
+
+
+def _ranked_triples(corpus):
+    """
+    Counts every (pair, next character) triple in `corpus` with NumPy and
+    returns a list of (pair, [(letter, count), ...]) with the pairs in the
+    order they first appear in `corpus` and each pair's letters in the order
+    a SortedFrequencyList fed the corpus one character at a time would hold
+    them.
+
+    That order is by descending count, and letters with equal counts are
+    ordered by when they reached that count, ie, by their last occurrence.
+
+    >>> _ranked_triples('pitter patter')[:4]  # doctest: +NORMALIZE_WHITESPACE
+    [('pi', [('t', 1)]), ('it', [('t', 1)]), ('tt', [('e', 2)]),
+     ('te', [('r', 2)])]
+    >>> _ranked_triples('ab ac ab')[2]
+    (' a', [('c', 1), ('b', 1)])
+    >>> _ranked_triples('ab')
+    []
+    """
+    n_triples = len(corpus) - 2
+    if n_triples <= 0:
+        return []
+    codes = np.frombuffer(corpus.encode('utf-32-le'), dtype='<u4')
+    alphabet, codes = np.unique(codes, return_inverse=True)
+    codes = codes.astype(np.int64)
+    size = len(alphabet)
+    prefixes = codes[:n_triples] * size + codes[1:n_triples + 1]
+    triples = prefixes * size + codes[2:]
+
+    # A stable sort groups equal triples with their positions ascending
+    order = np.argsort(triples, kind='stable')
+    triples = triples[order]
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            triples[1:] != triples[:-1])))
+    ends = np.append(starts[1:], n_triples)
+    counts = ends - starts
+    first_seen = order[starts]
+    last_seen = order[ends - 1]
+    triples = triples[starts]
+
+    # Triples are grouped by pair too, so each pair's first appearance is
+    # the earliest first appearance within its group
+    prefixes = triples // size
+    pair_starts = np.flatnonzero(np.concatenate(
+        ([True], prefixes[1:] != prefixes[:-1])))
+    pair_first = np.minimum.reduceat(first_seen, pair_starts)
+    pair_first = np.repeat(pair_first, np.diff(np.append(pair_starts,
+                                                         len(prefixes))))
+    ranked = np.lexsort((last_seen, -counts, pair_first))
+
+    chars = [chr(code) for code in alphabet.tolist()]
+    result = []
+    last_prefix = None
+    for prefix, letter, count in zip(prefixes[ranked].tolist(),
+                                     (triples[ranked] % size).tolist(),
+                                     counts[ranked].tolist()):
+        if prefix != last_prefix:
+            followers = []
+            result.append((chars[prefix // size] + chars[prefix % size],
+                           followers))
+            last_prefix = prefix
+        followers.append((chars[letter], count))
+    return result
+
+
+def process_corpus(corpus, unique_chars, growable=False, backend='python',
+                   top_k=None):
     """
     Returns a PrefixTable populated with the possible characters that follow
     each character pair in `corpus`. `unique_chars` is the number of unique
@@ -434,6 +983,21 @@ def process_corpus(corpus, unique_chars):
     the actual number of unique paris in the corpus will be considerably less
     than this, so we are guaranteed a low load factor.
 
+    If `growable` is True a GrowablePrefixTable is used instead, which is
+    sized by the pairs actually seen, and `unique_chars` is ignored.
+
+    `backend` chooses how the corpus is counted:
+      'python' feeds it through the table one character at a time.
+      'numpy' counts all the (pair, next character) triples with array
+      operations first and then stores each pair once, which should be at
+      least five times faster on the test_files corpora. Both produce the
+      same table, down to the order of tied letters and the slot each pair
+      lands in.
+
+    If `top_k` is given, each prefix keeps only about its `top_k` most
+    frequent followers, in TopKFrequencyLists. This needs the 'python'
+    backend.
+
 
     >>> process_corpus('lazy languid line', 11) #doctest: +ELLIPSIS
     Prefix hash Table
@@ -595,166 +1159,2750 @@ def process_corpus(corpus, unique_chars):
        46: None
        47: PfI('ou': SFL(<'g': 5>))
        48: None
+    >>> table = process_corpus('pitter patter', None, growable=True)
+    >>> table.n_slots, table.n_items
+    (16, 9)
+    >>> table.fetch('tt')
+    SFL(<'e': 2>)
+    >>> corpus = 'through tough thorough thought though'
+    >>> fast = process_corpus(corpus, 7, backend='numpy')
+    >>> repr(fast) == repr(process_corpus(corpus, 7))
+    True
+    >>> process_corpus(corpus, 7, top_k=1).fetch(' t')
+    SFL(<'h': 4>)
     
     """
-    table = PrefixTable(unique_chars**2)
-    for counter in range(0, len(corpus)-2):
-        pair = corpus[counter] + corpus[counter+1]
-        prefix_item = table.fetch(pair)
-        new_char = corpus[counter+2]
-        if prefix_item is None:
-            possibles = SortedFrequencyList()
-            possibles.add(new_char)
-            table.store(pair, possibles)
-        else:
-            prefix_item.add(new_char)
-            
+    if backend not in ('python', 'numpy'):
+        raise ValueError('unknown backend: {!r}'.format(backend))
+    if backend == 'numpy' and np is None:
+        raise ImportError("the 'numpy' backend needs NumPy installed")
+    if top_k is not None and backend != 'python':
+        raise ValueError("top_k needs the 'python' backend")
+    if growable:
+        table = GrowablePrefixTable()
+    else:
+        table = PrefixTable(unique_chars**2)
+    table.top_k = top_k
+    if backend == 'numpy':
+        _store_ranked(table, _ranked_triples(corpus))
+    else:
+        _add_pairs(table, corpus)
+    table.tail = corpus[-table.prefix_len:]
     return table
 
 
-""" def run_time_trials():
-    """""" A good place to write code for time trials
-    Make sure you use this docstring to explain your code and that
-    you write comments in your code to help explain the process.
-    """"""
-    corpus_filename = 'le-rire.txt'
-    with open(corpus_filename) as infile:
-        print('Loading corpus... '+corpus_filename)
-        full_corpus = format_document(infile.read())
-        phrase = 'The big dog'
-        phrase = 'Hello isn\'t it a lovely day today.'
-        phrase = 'The quick brown fox jumps over the lazy dog'
-        results = []
-        start = 1000
-        end = 240000
-        step = 10000
-        for i in range(start, end, step):
-            slice_of_corpus = full_corpus[0:i]
-            len_of_slice = len(slice_of_corpus)
-            unique_chars = len(set(slice_of_corpus))
-            table = process_corpus(slice_of_corpus, unique_chars)
-            print(table)
-            guesses, time_taken = play_game(table, phrase)   #autorun
-            print('{} {}'.format(len_of_slice , time_taken))
-            results.append((len_of_slice , guesses, time_taken))
-            print('{:>10}\t{:>6}\t{:>12}'.format('size', 'guesses', 'time'))
-            for size, guesses, time in results:
-                print('{:10}\t{:6}\t{:12.8f}'.format(size, guesses, time))
-                print()
-                print('Full size = {}'.format(len(full_corpus)))
+def _add_pairs(table, corpus):
+    """
+    Adds the character following each pair in `corpus` to the possibles
+    for that pair in `table`, one position at a time, and returns `table`.
+    """
+    # Every pair is hashed once up front, then reused by fetch and store
+    hashes = bulk_nice_hash(corpus)
+    for block in range(0, len(corpus)-2, _HASH_BLOCK):
+        block_hashes = hashes[block:block + _HASH_BLOCK].tolist()
+        stop = min(block + _HASH_BLOCK, len(corpus)-2)
+        for counter in range(block, stop):
+            pair = corpus[counter] + corpus[counter+1]
+            hash_value = block_hashes[counter - block]
+            prefix_item = table.fetch(pair, hash_value)
+            new_char = corpus[counter+2]
+            if prefix_item is None:
+                if table.top_k is None:
+                    possibles = SortedFrequencyList()
+                else:
+                    possibles = TopKFrequencyList(table.top_k)
+                possibles.add(new_char)
+                table.store(pair, possibles, hash_value)
+            else:
+                prefix_item.add(new_char)
+    return table
 
-"""
-    
-def run_some_trials():
-    """ Play some games with various test phrases and settings """
-    # play game using whatever you like
-    # maybe put an input statement here
-    # so you can enter the corpus
-    # and settings
-    # or just run various games with various settings
 
-    test_phrases = ['dead war', 'through tough thorough thought though',
-    'Hello isn\'t it a lovely day today.']
+def _count_shard(shard, offset):
+    """
+    Counts the (pair, next character) triples starting at each position of
+    `shard`, a piece of a corpus starting at position `offset`.
+    Returns a dict of triple: [count, first position, last position].
+    """
+    counts = {}
+    for counter in range(len(shard) - 2):
+        triple = shard[counter:counter+3]
+        entry = counts.get(triple)
+        if entry is None:
+            counts[triple] = [1, counter + offset, counter + offset]
+        else:
+            entry[0] += 1
+            entry[2] = counter + offset
+    return counts
 
-    # MAKE SURE you test with various phrases!
 
-    test_files = ['the-yellow-wall-paper.txt', 'hamlet.txt', 'le-rire.txt',
-    'war-of-the-worlds.txt', 'ulysses.txt', 'war-and-peace.txt']
+def _merge_shard_counts(shard_counts):
+    """
+    Combines the dicts returned by _count_shard into the same ranking
+    _ranked_triples gives: pairs by first appearance and each pair's letters
+    by descending count, then by last appearance.
+    """
+    totals = {}
+    for counts in shard_counts:
+        for triple, (count, first, last) in counts.items():
+            entry = totals.get(triple)
+            if entry is None:
+                totals[triple] = [count, first, last]
+            else:
+                entry[0] += count
+                entry[1] = min(entry[1], first)
+                entry[2] = max(entry[2], last)
+    pairs = {}
+    for triple, (count, first, last) in totals.items():
+        pair = pairs.get(triple[:2])
+        if pair is None:
+            pairs[triple[:2]] = [first, [(-count, last, triple[2])]]
+        else:
+            pair[0] = min(pair[0], first)
+            pair[1].append((-count, last, triple[2]))
+    ranked = []
+    for pair, (_, followers) in sorted(pairs.items(),
+                                       key=lambda item: item[1][0]):
+        followers.sort()
+        ranked.append((pair, [(letter, -count)
+                              for count, _, letter in followers]))
+    return ranked
 
-    #Uncomment the block below to run trials based on the lists of phrases and files above
-    for test_phrase in test_phrases:
-        for corpus_filename in test_files:
-            phrase_length = 0   # for auto-run
-            load_corpus_and_play(corpus_filename, test_phrase, phrase_length)
-            print('\n'*3)
 
-    # load_corpus_and_play(corpus_filename, 'ba', 7)
+def process_corpus_parallel(corpus, unique_chars, growable=False,
+                            workers=None, n_shards=None):
+    """
+    Returns the same PrefixTable as process_corpus(corpus, unique_chars,
+    growable), but counts the corpus in a pool of `workers` processes
+    (defaulting to one per CPU).
 
+    The corpus is split into `n_shards` pieces (one per worker by default),
+    each running two characters into the next so the pairs spanning a
+    boundary are counted exactly once. Shards report each triple's count
+    with its first and last position, which is everything needed to put
+    tied letters back into serial order once the counts are summed.
 
-def test():
-    """ Runs doctests """
-    # uncomment various doctest runs to check each method/function
-    # MAKE sure your submitted code doesn't run tests except
-    # MAKE SURE you add some doctests of your own to the docstrings
+    >>> corpus = 'through tough thorough thought though'
+    >>> table = process_corpus_parallel(corpus, 7, workers=2, n_shards=5)
+    >>> repr(table) == repr(process_corpus(corpus, 7))
+    True
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if n_shards is None:
+        n_shards = workers
+    n_positions = max(0, len(corpus) - 2)
+    bounds = [n_positions * shard // n_shards for shard in range(n_shards + 1)]
+    starts = bounds[:-1]
+    shards = [corpus[start:stop + 2] for start, stop in zip(starts,
+                                                            bounds[1:])]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shard_counts = list(pool.map(_count_shard, shards, starts))
 
-    # doctest.run_docstring_examples(Frequency, globs=None)
-    # doctest.run_docstring_examples(FrequencyList.add, globs=None)
-    # doctest.run_docstring_examples(FrequencyList.remove, globs=None)
-    # doctest.run_docstring_examples(FrequencyList.find, globs=None)
+    if growable:
+        table = GrowablePrefixTable()
+    else:
+        table = PrefixTable(unique_chars**2)
+    _store_ranked(table, _merge_shard_counts(shard_counts))
+    table.tail = corpus[-table.prefix_len:]
+    return table
 
-    # doctest.run_docstring_examples(filter_possible_chars, globs=None)
-    # doctest.run_docstring_examples(count_frequencies, globs=None)
-    # doctest.run_docstring_examples(select_next_guess, globs=None)
 
-    # you can leave the following line uncommented as long as your code
-    # passes all the tests the line won't produce any output
-    doctest.testmod()  # run all doctests - this is helpful before you submit
+class PrefixTableBuilder(object):
+    """
+    Builds a PrefixTable from a corpus fed in pieces, eg, as it is read from
+    a file. The last two characters fed are kept (as the table's tail) so
+    the pairs spanning two pieces are counted, and feeding a corpus in any
+    number of pieces gives the same possibles as process_corpus on the
+    whole of it.
 
-    # Uncomment the call to run_some_trials below to run
-    # whatever trials you have setup in that function
-    # IMPORTANT: comment out the run_some_trials() line below
-    # before you submit your code
-    run_some_trials()
+    >>> builder = PrefixTableBuilder()
+    >>> for piece in ('pit', 't', 'er p', 'atter'):
+    ...     builder.feed(piece)
+    >>> builder.n_chars
+    13
+    >>> builder.table.fetch('tt')
+    SFL(<'e': 2>)
+    >>> builder.table.fetch('r ')
+    SFL(<'p': 1>)
+    """
 
-    # IMPORTANT: comment out the run_time_trials() line below
-    # before you submit your code
-    run_time_trials()
+    def __init__(self, table=None):
+        """
+        Initialises the builder to add to `table`, or to a new
+        GrowablePrefixTable if `table` is None.
+        """
+        self.table = GrowablePrefixTable() if table is None else table
+        self.n_chars = 0
 
+    def feed(self, text):
+        """Adds the (already formatted) `text` to the table"""
+        self.n_chars += len(text)
+        update(self.table, text)
 
 
-def fallback_guesses(possibles):
+def load_corpus_streaming(corpus_filename, chunk_size=1 << 16):
     """
-    Returns all characters from a--z, and some punctuation that don't appear in
-    `possibles`.
+    Maps, formats and processes `corpus_filename` `chunk_size` bytes at a
+    time through a CorpusSource, so only one chunk of the formatted corpus
+    is in memory at once alongside the table. Returns the table and the
+    formatted corpus length.
     """
-    all_fallbacks = [chr(c) for c in range(ord('a'), ord('z') + 1)] + \
-                    [' ', ',', '.', "'", '"', ';', '!', '?']
-    return [x for x in all_fallbacks if x not in possibles]
+    normalizer = DocumentNormalizer()
+    builder = PrefixTableBuilder()
+    with CorpusSource(corpus_filename, chunk_size) as source:
+        for piece in source:
+            builder.feed(normalizer.feed(piece))
+    return builder.table, builder.n_chars
 
 
-def format_document(doc):
+class _TrieLevel(object):
     """
-    Re-formats `d` by collapsing all whitespace characters into a space and
-    stripping all characters that aren't letters or punctuation.
+    The nodes at one depth of a ContextTrie, as flat arrays of unsigned
+    32-bit ints: each node's character (sorted within each parent), the
+    offset of its first child in the next level (plus a final end offset)
+    and the offset of its possibles in the follower arrays (likewise), and
+    the follower code points and counts.
     """
-    from unicodedata import category
-    # http://www.unicode.org/reports/tr44/#General_Category_Values
-    allowed_types = ('Lu', 'Ll', 'Lo', 'Po', 'Zs')
-    #d = unicode(d, 'utf-8')
-    #d = str(d, 'utf-8')
-    # Collapse whitespace
-    doc = re.compile(r'\s+', re.UNICODE).sub(' ', doc)
-    doc = u''.join([cat.lower()
-                    for cat in doc if category(cat) in allowed_types])
-    # Remove .encode() to properly process a unicode corpus
-    return doc
 
+    __slots__ = ('chars', 'children', 'offsets', 'letters', 'counts')
 
-def confirm(prompt):
-    """
-    Asks the user to confirm a yes/no question.
-    Returns True/False based on their answer.
-    """
-    ans = ' '
-    while ans[0] not in ('Y', 'y', 'n', 'N'):
-        ans = input(prompt + ' (y/n) ')
-    return True if ans[0] in ('Y', 'y') else False
+    def __init__(self):
+        self.chars = array('I')
+        self.children = array('I', [0])
+        self.offsets = array('I', [0])
+        self.letters = array('I')
+        self.counts = array('I')
 
+    def add_node(self, char, corpus, positions):
+        """
+        Adds a node for `char` whose context is followed by the characters
+        of `corpus` at `positions` (in corpus order).
+        """
+        self.chars.append(ord(char))
+        if len(positions) == 1:
+            self.letters.append(ord(corpus[positions[0]]))
+            self.counts.append(1)
+        else:
+            # Ranked like a SortedFrequencyList: by count, then by the
+            # position the letter reached that count
+            followers = {}
+            for position in positions:
+                entry = followers.get(corpus[position])
+                if entry is None:
+                    followers[corpus[position]] = [-1, position]
+                else:
+                    entry[0] -= 1
+                    entry[1] = position
+            for letter, (count, _) in sorted(followers.items(),
+                                             key=lambda item: item[1]):
+                self.letters.append(ord(letter))
+                self.counts.append(-count)
+        self.offsets.append(len(self.letters))
 
-def check_guess(next_char, guess):
-    """
-    Returns True if `guess` matches `next_char`, or asks the user if
-    `next_char` is None.
-    """
-    if next_char is not None:
-        return next_char == guess
-    else:
-        return confirm(" '{}'?".format(guess))
+    def possibles(self, node):
+        start, stop = self.offsets[node], self.offsets[node + 1]
+        return PossiblesView(self.letters[start:stop],
+                             self.counts[start:stop])
 
 
-def next_guess(guesses):
-    """ Returns the next guess """
-    return guesses.pop(0) if len(guesses) else None
+class _OrderView(object):
+    """A ContextTrie seen as a table of prefixes of one length"""
+
+    # Games start from two characters whatever the order, as they do
+    # against a PrefixTable
+    seed_len = 2
+
+    def __init__(self, trie, order):
+        self.trie = trie
+        self.prefix_len = order
+
+    def fetch(self, prefix):
+        """Returns the possibles following `prefix`, or None"""
+        return self.trie.fetch(prefix)
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+
+class ContextTrie(object):
+    """
+    Stores the possible characters following every context of 1 to
+    `max_order` characters in a corpus, so a single build can play the game
+    with any prefix length up to `max_order`.
+
+    Contexts are stored backwards, ie, the root's child for 'e' holds what
+    follows 'e', that node's child for 'h' holds what follows 'he', and so
+    on, so all the contexts ending in the same characters share nodes.
+    The trie is built a level at a time, splitting each node's corpus
+    positions by the character before its context, and each level is held
+    in the flat arrays of a _TrieLevel rather than as an object per node.
+    A node costs 12 bytes and each distinct (context, follower) pair 8
+    more. Each node's possibles are ranked as a SortedFrequencyList built
+    in corpus order would be, so for prefixes of two characters they are
+    identical to those from process_corpus. fetch returns a PossiblesView.
+
+    >>> trie = ContextTrie('through tough thorough thought though', 4)
+    >>> trie.fetch('h')
+    SFL(<' ': 3>, <'o': 3>, <'r': 1>, <'t': 1>)
+    >>> trie.fetch('th')
+    SFL(<'o': 3>, <'r': 1>)
+    >>> trie.fetch(' tho')
+    SFL(<'u': 2>, <'r': 1>)
+    >>> print(trie.fetch('thre'))
+    None
+    >>> print(trie.fetch('hough'))
+    None
+    >>> trie.n_nodes
+    57
+    >>> view = trie.at_order(3)
+    >>> view.prefix_len, view.seed_len
+    (3, 2)
+    >>> view.fetch('oug')
+    SFL(<'h': 5>)
+    """
+
+    seed_len = 2
+
+    def __init__(self, corpus='', max_order=8):
+        """
+        Builds the trie for contexts of up to `max_order` characters in
+        `corpus`.
+        """
+        if max_order < 1:
+            raise ValueError('max_order must be at least 1')
+        self.max_order = max_order
+        self.prefix_len = max_order
+        self.tail = corpus[-max_order:]
+        self.levels = []
+        # The positions following each node of the last level built, in
+        # node order, and where each node's positions start and stop
+        positions = array('I', range(1, len(corpus)))
+        bounds = array('I', [0, len(positions)])
+        for depth in range(1, max_order + 1):
+            level = _TrieLevel()
+            next_positions = array('I')
+            next_bounds = array('I', [0])
+            for parent in range(len(bounds) - 1):
+                groups = {}
+                for position in positions[bounds[parent]:bounds[parent + 1]]:
+                    if position >= depth:
+                        char = corpus[position - depth]
+                        group = groups.get(char)
+                        if group is None:
+                            groups[char] = [position]
+                        else:
+                            group.append(position)
+                for char in sorted(groups):
+                    level.add_node(char, corpus, groups[char])
+                    next_positions.extend(groups[char])
+                    next_bounds.append(len(next_positions))
+                if self.levels:
+                    self.levels[-1].children.append(len(level.chars))
+            self.levels.append(level)
+            positions, bounds = next_positions, next_bounds
+        self.n_nodes = sum(len(level.chars) for level in self.levels)
+
+    def fetch(self, prefix):
+        """
+        Returns a PossiblesView of the possibles following `prefix`, or
+        None if it never appears in the corpus or is longer than max_order.
+        """
+        if not prefix or len(prefix) > self.max_order:
+            return None
+        start, stop = 0, len(self.levels[0].chars)
+        for depth, char in enumerate(reversed(prefix)):
+            level = self.levels[depth]
+            code = ord(char)
+            node = bisect_left(level.chars, code, start, stop)
+            if node == stop or level.chars[node] != code:
+                return None
+            if depth + 1 < len(prefix):
+                start = level.children[node]
+                stop = level.children[node + 1]
+        return level.possibles(node)
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+    def at_order(self, order):
+        """
+        Returns a view of the trie for playing with prefixes of `order`
+        characters.
+        """
+        if not 1 <= order <= self.max_order:
+            raise ValueError('order must be between 1 and max_order')
+        return _OrderView(self, order)
+
+
+def run_order_trials(filenames=TEST_FILES, max_order=8):
+    """
+    Builds a ContextTrie of every order from 1 to `max_order` for each file
+    in `filenames` and prints how long each build took, how many contexts it
+    holds and how much memory the finished trie uses.
+    Tracing allocations slows the build down a lot, so each trie is built
+    twice: once to time it and once to measure it.
+    """
+    print('{:>28} {:>5} {:>10} {:>10} {:>10}'.format(
+        'corpus', 'order', 'seconds', 'contexts', 'MiB'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        for order in range(1, max_order + 1):
+            start = time.perf_counter()
+            trie = ContextTrie(corpus, order)
+            time_taken = time.perf_counter() - start
+            del trie
+            tracemalloc.start()
+            trie = ContextTrie(corpus, order)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('{:>28} {:5} {:10.3f} {:10} {:10.1f}'.format(
+                corpus_filename, order, time_taken, trie.n_nodes,
+                memory / 2**20))
+            del trie
+
+
+class PossiblesView(object):
+    """
+    A read-only list of possibles held as two parallel arrays of letter code
+    points and counts, already sorted from the highest count to the lowest.
+    Iterates, finds and prints like a SortedFrequencyList.
+
+    >>> view = PossiblesView(array('I', [101, 111]), array('I', [40, 10]))
+    >>> view
+    SFL(<'e': 40>, <'o': 10>)
+    >>> list(view)
+    ['e', 'o']
+    >>> view.find('o')
+    <'o': 10>
+    >>> 'a' in view
+    False
+    """
+
+    __slots__ = ('letters', 'counts')
+
+    def __init__(self, letters, counts):
+        self.letters = letters
+        self.counts = counts
+
+    def items(self):
+        """ Yields (letter, frequency) pairs from highest to lowest frequency
+        """
+        for code, count in zip(self.letters, self.counts):
+            yield chr(code), count
+
+    def find(self, letter):
+        """
+        Returns a Frequency for the given `letter`, or None if the `letter`
+        doesn't appear in the list.
+        """
+        for code, count in zip(self.letters, self.counts):
+            if code == ord(letter):
+                return Frequency(letter, count)
+        return None
+
+    def __contains__(self, item):
+        return self.find(item) is not None
+
+    def __len__(self):
+        return len(self.letters)
+
+    def __iter__(self):
+        for code in self.letters:
+            yield chr(code)
+
+    def __repr__(self):
+        return 'SFL(' + ', '.join(repr(Frequency(letter, count))
+                                  for letter, count in self.items()) + ')'
+
+
+# Compiled model files start with this header, followed by the corpus tail
+# (prefix_len code points, zero padded) and five arrays of unsigned 32-bit
+# ints: the hash index, each prefix's code points, each
+# prefix's offset into the follower arrays (plus a final end offset), the
+# follower code points and the follower counts.
+_MODEL_MAGIC = b'SPTM'
+_MODEL_VERSION = 2
+_MODEL_HEADER = struct.Struct('<4sHBBIIII')
+
+
+def _flatten_table(table):
+    """
+    Returns the contents of `table` (anything with items() and prefix_len)
+    as (bits, index, prefixes, offsets, letters, counts): unsigned 32-bit
+    int arrays of each prefix's code points, each prefix's offset into the
+    follower arrays (plus a final end offset), the follower code points and
+    counts, and an open addressing hash index of 2**bits slots holding
+    record number + 1 (0 for empty). Every prefix must be prefix_len
+    characters long and every count a whole number.
+    """
+    prefix_len = table.prefix_len
+    prefixes = array('I')
+    offsets = array('I', [0])
+    letters = array('I')
+    counts = array('I')
+    for prefix, possibles in table.items():
+        if len(prefix) != prefix_len:
+            raise ValueError('prefix {!r} is not {} characters long'.format(
+                prefix, prefix_len))
+        prefixes.extend(ord(char) for char in prefix)
+        for letter, count in possibles.items():
+            if count != int(count):
+                raise ValueError('count {!r} for {!r} after {!r} is not a '
+                                 'whole number'.format(count, letter, prefix))
+            letters.append(ord(letter))
+            counts.append(int(count))
+        offsets.append(len(letters))
+    n_prefixes = len(offsets) - 1
+
+    # Open addressing with linear probing, kept at most half full
+    bits = max(1, (2 * n_prefixes).bit_length())
+    index = array('I', [0]) * (1 << bits)
+    mask = len(index) - 1
+    for record in range(n_prefixes):
+        prefix = ''.join(chr(code) for code in
+                         prefixes[record * prefix_len:
+                                  (record + 1) * prefix_len])
+        slot = _c_mul(nice_hash(prefix), 0x9E3779B1) >> (32 - bits)
+        while index[slot]:
+            slot = (slot + 1) & mask
+        index[slot] = record + 1
+    return bits, index, prefixes, offsets, letters, counts
+
+
+def compile_table(table, filename):
+    """
+    Writes `table` (a PrefixTable or anything else with items(), prefix_len
+    and tail) to `filename` in the compiled model format read by
+    CompiledModel. Every prefix must be prefix_len characters long and
+    every count a whole number.
+    The file is written under a temporary name and then renamed, so
+    readers never see a half written model.
+    """
+    if isinstance(table, CompactPrefixTable):
+        bits, arrays = table._bits, table._arrays()
+    else:
+        flattened = _flatten_table(table)
+        bits, arrays = flattened[0], flattened[1:]
+    n_prefixes = len(arrays[2]) - 1
+    tail = table.tail
+    header = _MODEL_HEADER.pack(_MODEL_MAGIC, _MODEL_VERSION, table.prefix_len,
+                                len(tail), bits, n_prefixes, len(arrays[3]),
+                                sys.byteorder == 'little')
+    tail_codes = array('I', map(ord, tail))
+    tail_codes.extend([0] * (table.prefix_len - len(tail)))
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temp_filename, 'wb') as outfile:
+        outfile.write(header)
+        tail_codes.tofile(outfile)
+        for values in arrays:
+            if isinstance(values, memoryview):
+                outfile.write(values)
+            else:
+                values.tofile(outfile)
+    os.replace(temp_filename, filename)
+
+
+class CompactPrefixTable(object):
+    """
+    A read-only copy of a PrefixTable (or anything else with items() and
+    prefix_len) held in five flat arrays of unsigned 32-bit ints rather than
+    as a PrefixItem, a SortedFrequencyList and a Frequency per follower.
+    Each distinct (prefix, follower) pair costs 8 bytes, plus a few bytes
+    per prefix for its code points, offset and hash slot.
+    fetch returns a PossiblesView, which iterates like a SortedFrequencyList.
+
+    >>> table = CompactPrefixTable(process_corpus('pitter patter', 7))
+    >>> table.n_items, table.n_pairs
+    (9, 9)
+    >>> table.fetch('tt')
+    SFL(<'e': 2>)
+    >>> list(table.fetch('te'))
+    ['r']
+    >>> print(table.fetch('zz'))
+    None
+    >>> 'r ' in table
+    True
+    >>> table.nbytes()
+    312
+    """
+
+    def __init__(self, table):
+        """Copies the prefixes and possibles of `table`"""
+        self.prefix_len = table.prefix_len
+        self.tail = getattr(table, 'tail', '')
+        (self._bits, self._index, self._prefixes, self._offsets,
+         self._letters, self._counts) = _flatten_table(table)
+        self._set_sizes()
+
+    def _set_sizes(self):
+        self.n_items = len(self._offsets) - 1
+        self.n_pairs = len(self._letters)
+        self._mask = len(self._index) - 1
+
+    def _arrays(self):
+        return (self._index, self._prefixes, self._offsets, self._letters,
+                self._counts)
+
+    def nbytes(self):
+        """Returns the number of bytes held in the arrays"""
+        return sum(values.itemsize * len(values) for values in self._arrays())
+
+    def _possibles(self, record):
+        start, stop = self._offsets[record], self._offsets[record + 1]
+        return PossiblesView(self._letters[start:stop],
+                             self._counts[start:stop])
+
+    def fetch(self, prefix):
+        """
+        Returns a PossiblesView of the possibles for `prefix`, or None if
+        the `prefix` isn't in the table.
+        """
+        if len(prefix) != self.prefix_len:
+            return None
+        codes = [ord(char) for char in prefix]
+        slot = _c_mul(nice_hash(prefix), 0x9E3779B1) >> (32 - self._bits)
+        while True:
+            record = self._index[slot]
+            if not record:
+                return None
+            record -= 1
+            start = record * self.prefix_len
+            if self._prefixes[start:start + self.prefix_len].tolist() == codes:
+                return self._possibles(record)
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+    def items(self):
+        """ Yields (prefix, possibles) for each prefix in the table """
+        prefix_len = self.prefix_len
+        for record in range(self.n_items):
+            codes = self._prefixes[record * prefix_len:
+                                   (record + 1) * prefix_len]
+            yield ''.join(map(chr, codes)), self._possibles(record)
+
+
+class CompiledModel(CompactPrefixTable):
+    """
+    A model written by compile_table, memory-mapped rather than read in.
+    Opening one only maps the file and reads its header, and fetch reads
+    straight from the mapped pages, so a model of any size is ready in
+    milliseconds and processes using the same file share its pages.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> filename = os.path.join(directory.name, 'pitter.model')
+    >>> compile_table(process_corpus('pitter patter', 7), filename)
+    >>> model = CompiledModel(filename)
+    >>> model.n_items, model.prefix_len
+    (9, 2)
+    >>> model.fetch('tt')
+    SFL(<'e': 2>)
+    >>> list(model.fetch('te'))
+    ['r']
+    >>> print(model.fetch('zz'))
+    None
+    >>> 'r ' in model
+    True
+    >>> model.close()
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, filename):
+        """Maps the compiled model in `filename`"""
+        self.filename = filename
+        with open(filename, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.prefix_len, tail_len, self._bits,
+             self.n_items, n_followers,
+             little_endian) = _MODEL_HEADER.unpack_from(
+                 self._mmap)
+        except struct.error:
+            self._mmap.close()
+            raise ValueError('{} is not a compiled model'.format(filename))
+        if magic != _MODEL_MAGIC or version != _MODEL_VERSION:
+            self._mmap.close()
+            raise ValueError('{} is not a version {} compiled model'.format(
+                filename, _MODEL_VERSION))
+        if little_endian != (sys.byteorder == 'little'):
+            self._mmap.close()
+            raise ValueError('{} was compiled on a machine of the other '
+                             'byte order'.format(filename))
+        words = memoryview(self._mmap)[_MODEL_HEADER.size:].cast('I')
+        self.tail = ''.join(map(chr, words[:tail_len]))
+        words = words[self.prefix_len:]
+        sizes = (1 << self._bits, self.n_items * self.prefix_len,
+                 self.n_items + 1, n_followers, n_followers)
+        arrays = []
+        for size in sizes:
+            arrays.append(words[:size])
+            words = words[size:]
+        (self._index, self._prefixes, self._offsets, self._letters,
+         self._counts) = arrays
+        self._set_sizes()
+
+    def close(self):
+        """
+        Unmaps the file. Any PossiblesView still referenced keeps the
+        mapping open, in which case this raises BufferError.
+        """
+        for values in self._arrays():
+            values.release()
+        self._mmap.close()
+
+    def __reduce__(self):
+        # Another process just maps the same file
+        return (CompiledModel, (self.filename,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class UpdatedModel(object):
+    """
+    A read-only model (a CompactPrefixTable or CompiledModel) with more
+    text added to the end of its corpus. The possibles of each prefix the
+    new text touches are copied out of the model into a GrowablePrefixTable
+    of changes the first time they are needed and updated there, so the
+    work done is proportional to the new text. compile_table folds the
+    changes back into a new compiled model.
+
+    >>> compact = CompactPrefixTable(process_corpus('pitter pat', 7))
+    >>> updated = UpdatedModel(compact)
+    >>> updated.feed('ter')
+    >>> updated.fetch('tt'), compact.fetch('tt')
+    (SFL(<'e': 2>), SFL(<'e': 1>))
+    >>> updated.fetch('at')
+    SFL(<'t': 1>)
+    >>> updated.tail
+    'er'
+    """
+
+    def __init__(self, base):
+        """Initialises the model to add to the read-only model `base`"""
+        self.base = base
+        self.prefix_len = base.prefix_len
+        self.tail = base.tail
+        self.changes = GrowablePrefixTable()
+
+    def feed(self, text):
+        """Adds the (already formatted) `text` to the model"""
+        text = self.tail + text
+        for counter in range(len(text) - self.prefix_len):
+            pair = text[counter:counter + self.prefix_len]
+            possibles = self.changes.fetch(pair)
+            if possibles is None:
+                # Adding the letters in order gives the same list back
+                possibles = SortedFrequencyList()
+                original = self.base.fetch(pair)
+                if original is not None:
+                    for letter, count in original.items():
+                        possibles.add(letter, count)
+                self.changes.store(pair, possibles)
+            possibles.add(text[counter + self.prefix_len])
+        self.tail = text[-self.prefix_len:]
+
+    def fetch(self, prefix):
+        """
+        Returns the possibles for `prefix`, or None if the `prefix` isn't in
+        the model.
+        """
+        possibles = self.changes.fetch(prefix)
+        if possibles is None:
+            possibles = self.base.fetch(prefix)
+        return possibles
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+    def items(self):
+        """ Yields (prefix, possibles) for each prefix in the model """
+        for prefix, possibles in self.base.items():
+            changed = self.changes.fetch(prefix)
+            yield prefix, possibles if changed is None else changed
+        for prefix, possibles in self.changes.items():
+            if prefix not in self.base:
+                yield prefix, possibles
+
+
+def _make_room(table, text):
+    """
+    Moves the items of the fixed size PrefixTable `table` into a larger
+    array of slots if it doesn't have room for the pairs in `text` it
+    doesn't hold yet.
+    """
+    prefix_len = table.prefix_len
+    pairs = set(text[position:position + prefix_len]
+                for position in range(len(text) - prefix_len))
+    needed = table.n_items + sum(1 for pair in pairs
+                                 if table.fetch(pair) is None)
+    if needed <= table.n_slots:
+        return
+    items = list(table.items())
+    table.n_slots = 2 * needed
+    table.data = [None] * table.n_slots
+    table.n_items = 0
+    for prefix, possibles in items:
+        table.store(prefix, possibles)
+
+
+def update(model, new_text):
+    """
+    Adds the (already formatted) `new_text` to the end of the corpus `model`
+    was built from, without going over the rest of the corpus again, and
+    returns the updated model. The characters spanning the join are taken
+    from the model's tail.
+
+    A PrefixTable is updated in place and returned. A fixed size
+    PrefixTable that wouldn't have room for the new pairs is first moved
+    to one with twice as many slots as it then needs, so no counts are
+    lost. A read-only model is returned wrapped in an UpdatedModel (or, if
+    it is one already, fed the text).
+
+    >>> table = update(process_corpus('pitter pat', None, growable=True),
+    ...                'ter')
+    >>> table.fetch('tt')
+    SFL(<'e': 2>)
+    >>> whole = process_corpus('pitter patter', None, growable=True)
+    >>> sorted(map(repr, table.items())) == sorted(map(repr, whole.items()))
+    True
+    >>> compact = CompactPrefixTable(process_corpus('pitter pat', 7))
+    >>> update(update(compact, 't'), 'er').fetch('te')
+    SFL(<'r': 2>)
+    >>> table = update(process_corpus('ab ab', 3), 'xyzw vut srq')
+    >>> table.n_items, table.n_slots, table.fetch('vu')
+    (14, 28, SFL(<'t': 1>))
+    """
+    if isinstance(model, PrefixTable):
+        text = model.tail + new_text
+        if not isinstance(model, GrowablePrefixTable):
+            _make_room(model, text)
+        _add_pairs(model, text)
+        model.tail = text[-model.prefix_len:]
+        return model
+    if not isinstance(model, UpdatedModel):
+        model = UpdatedModel(model)
+    model.feed(new_text)
+    return model
+
+
+# Weights given to merge_models are rounded to multiples of 1 / this
+_WEIGHT_DENOMINATOR = 1000
+
+
+def merge_models(models, weights=None):
+    """
+    Returns a GrowablePrefixTable holding the sum of the follower counts of
+    every model in `models` (PrefixTables or anything else with items()
+    and prefix_len), each multiplied by its weight in `weights` (1 for all
+    of them by default). Followers whose total isn't positive are dropped,
+    so a negative weight takes a corpus back out.
+
+    Counts stay whole numbers, so a merge can be compiled like any other
+    table: weights that aren't whole numbers are each rounded to the
+    nearest 1/1000 and then all multiplied by the smallest factor that
+    makes them whole, eg, [0.5, 0.25] counts as [2, 1]. This changes the
+    scale of the counts but not their ranking.
+
+    Each list is ranked by total count and then by letter, so merging is
+    commutative and associative: the result doesn't depend on the order
+    or grouping of the models. (Unlike process_corpus, ties aren't broken
+    by where letters last appeared, which can't be compared across
+    corpora.) The time taken depends only on the size of the models.
+
+    >>> pitter = process_corpus('pitter patter', None, growable=True)
+    >>> riff = process_corpus('riff raff patter', None, growable=True)
+    >>> both = merge_models([pitter, riff])
+    >>> both.fetch('te'), both.fetch('ff')
+    (SFL(<'r': 3>), SFL(<' ': 2>))
+    >>> both.fetch('pa')
+    SFL(<'t': 2>)
+    >>> repr(both) == repr(merge_models([riff, pitter]))
+    True
+    >>> merge_models([both, riff], [1, -1]).fetch('te')
+    SFL(<'r': 2>)
+    >>> print(subtract_model(both, riff).fetch('ff'))
+    None
+    >>> mostly_pitter = merge_models([pitter, riff], [0.5, 0.25])
+    >>> mostly_pitter.fetch('te'), mostly_pitter.fetch('ff')
+    (SFL(<'r': 5>), SFL(<' ': 2>))
+    >>> import os, tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'mostly-pitter.model')
+    ...     compile_table(mostly_pitter, filename)
+    ...     model = CompiledModel(filename)
+    ...     print(model.fetch('te'), model.fetch('ff'))
+    ...     model.close()
+    SFL(<'r': 5>) SFL(<' ': 2>)
+    """
+    models = list(models)
+    if weights is None:
+        weights = [1] * len(models)
+    if len(weights) != len(models):
+        raise ValueError('need one weight per model')
+    weights = [Fraction(weight).limit_denominator(_WEIGHT_DENOMINATOR)
+               for weight in weights]
+    scale = 1
+    for weight in weights:
+        scale = scale * weight.denominator // gcd(scale, weight.denominator)
+    weights = [int(weight * scale) for weight in weights]
+    prefix_lens = set(model.prefix_len for model in models)
+    if len(prefix_lens) > 1:
+        raise ValueError('models have different prefix lengths')
+    totals = {}
+    for model, weight in zip(models, weights):
+        for prefix, possibles in model.items():
+            counts = totals.setdefault(prefix, {})
+            for letter, count in possibles.items():
+                counts[letter] = counts.get(letter, 0) + count * weight
+
+    table = GrowablePrefixTable()
+    if prefix_lens:
+        table.prefix_len = prefix_lens.pop()
+    ranked = []
+    for prefix in sorted(totals):
+        followers = sorted(((letter, count) for letter, count
+                            in totals[prefix].items() if count > 0),
+                           key=lambda item: (-item[1], item[0]))
+        if followers:
+            ranked.append((prefix, followers))
+    return _store_ranked(table, ranked)
+
+
+def subtract_model(model, other):
+    """
+    Returns merge_models([model, other], [1, -1]): `model` with the counts
+    of `other` (eg, the model of one of the corpora merged into `model`)
+    taken back out.
+    """
+    return merge_models([model, other], [1, -1])
+
+
+class Codebook(object):
+    """
+    Numbers the distinct characters of a (formatted) corpus from 0, in
+    sorted order, so the rest of a model can work with small ints.
+
+    >>> codebook = Codebook('pitter patter')
+    >>> codebook.letters
+    (' ', 'a', 'e', 'i', 'p', 'r', 't')
+    >>> codebook.encode('tip')
+    [6, 3, 4]
+    >>> codebook.decode([6, 3, 4])
+    'tip'
+    """
+
+    def __init__(self, text):
+        self.letters = tuple(sorted(set(text)))
+        self.codes = {letter: code for code, letter in enumerate(self.letters)}
+
+    def __len__(self):
+        return len(self.letters)
+
+    def encode(self, text):
+        """Returns the list of codes for `text`, which may only hold
+        characters in the codebook.
+        """
+        return list(map(self.codes.__getitem__, text))
+
+    def decode(self, codes):
+        """Returns the text for a sequence of `codes`"""
+        return ''.join(map(self.letters.__getitem__, codes))
+
+
+# CodedModels with up to this many possible pairs index them with a list
+_DIRECT_PAIRS = 1 << 22
+
+
+class CodedModel(object):
+    """
+    A model of the characters that follow each pair in `corpus` built and
+    held with integer codes from a Codebook rather than strings.
+    Each pair is the int first * len(codebook) + second, which indexes a
+    list directly (or, for a very large alphabet, a dict) of the pair's
+    followers and their counts, ranked as a SortedFrequencyList fed the
+    corpus would rank them. Strings only come in at fetch and go out in
+    the PossiblesView it returns (made once per pair), whose iteration and
+    items() match a PrefixTable's.
+
+    >>> model = CodedModel('through tough thorough thought though')
+    >>> model.n_items
+    13
+    >>> model.fetch('th')
+    SFL(<'o': 3>, <'r': 1>)
+    >>> print(model.fetch('zz'))
+    None
+    >>> codes = model.codebook.encode('th')
+    >>> model.followers(model.pair_code(*codes))
+    ((3, 4), (3, 1))
+    """
+
+    prefix_len = 2
+
+    def __init__(self, corpus):
+        codebook = self.codebook = Codebook(corpus)
+        size = len(codebook)
+        self.tail = corpus[-self.prefix_len:]
+        codes = codebook.encode(corpus)
+        triples = [(first * size + second) * size + third for
+                   first, second, third in zip(codes, codes[1:], codes[2:])]
+        counts = Counter(triples)
+        # Later positions overwrite earlier ones, leaving each triple's last
+        last_seen = dict(zip(triples, range(len(triples))))
+        ranked = {}
+        for triple, count in counts.items():
+            pair, letter = divmod(triple, size)
+            ranked.setdefault(pair, []).append(
+                (-count, last_seen[triple], letter))
+
+        if size * size <= _DIRECT_PAIRS:
+            self._followers = [None] * (size * size)
+        else:
+            self._followers = {}
+        for pair, followers in ranked.items():
+            followers.sort()
+            self._followers[pair] = (
+                tuple(letter for _, _, letter in followers),
+                tuple(-count for count, _, _ in followers))
+        # Pairs in the order they first appear in the corpus
+        self._pairs = list(ranked)
+        self.n_items = len(self._pairs)
+        # PossiblesViews are made the first time each pair is fetched
+        self._views = {}
+
+    def pair_code(self, first, second):
+        """Returns the pair code for the codes `first` and `second`"""
+        return first * len(self.codebook) + second
+
+    def followers(self, pair):
+        """
+        Returns (letter codes, counts) for the pair code `pair`, highest
+        count first, or None if the pair never appears.
+        """
+        if isinstance(self._followers, dict):
+            return self._followers.get(pair)
+        return self._followers[pair]
+
+    def _possibles(self, pair):
+        view = self._views.get(pair)
+        if view is None:
+            letters, counts = self.followers(pair)
+            view = PossiblesView(array('I', map(ord, self.codebook.decode(
+                letters))), array('I', counts))
+            self._views[pair] = view
+        return view
+
+    def fetch(self, prefix):
+        """
+        Returns a PossiblesView of the possibles for `prefix`, or None if
+        the `prefix` isn't in the model.
+        """
+        if len(prefix) != self.prefix_len:
+            return None
+        codes = self.codebook.codes
+        first, second = codes.get(prefix[0]), codes.get(prefix[1])
+        if first is None or second is None:
+            return None
+        pair = first * len(self.codebook.letters) + second
+        if self.followers(pair) is None:
+            return None
+        return self._possibles(pair)
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+    def items(self):
+        """ Yields (prefix, possibles) for each prefix in the model """
+        size = len(self.codebook)
+        for pair in self._pairs:
+            yield self.codebook.decode(divmod(pair, size)), self._possibles(
+                pair)
+
+
+def run_coded_trials(filenames=TEST_FILES, n_lookups=100000):
+    """
+    Times building a CodedModel and a GrowablePrefixTable from each file in
+    `filenames` (after format_document), and `n_lookups` lookups of the
+    ranked followers of pairs taken from the corpus, both through fetch and,
+    for the CodedModel, with the pairs already encoded.
+    """
+    print('{:>28} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'corpus', 'table s', 'coded s', 'fetch us', 'coded us', 'codes us'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        start = time.perf_counter()
+        table = process_corpus(corpus, None, growable=True)
+        table_time = time.perf_counter() - start
+        start = time.perf_counter()
+        model = CodedModel(corpus)
+        coded_time = time.perf_counter() - start
+
+        step = max(1, (len(corpus) - 2) // n_lookups)
+        pairs = [corpus[position:position + 2]
+                 for position in range(0, len(corpus) - 2, step)]
+        encoded = [model.pair_code(*model.codebook.encode(pair))
+                   for pair in pairs]
+        lookup_times = []
+        for fetch, keys in ((table.fetch, pairs), (model.fetch, pairs),
+                            (model.followers, encoded)):
+            start = time.perf_counter()
+            for key in keys:
+                fetch(key)
+            lookup_times.append((time.perf_counter() - start) / len(keys))
+        print('{:>28} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:10.3f}'.format(
+            corpus_filename, table_time, coded_time,
+            *(seconds * 1e6 for seconds in lookup_times)))
+
+
+class LazyModel(object):
+    """
+    A model of `corpus` that works out each prefix's ranked possibles only
+    when they are first fetched, and remembers them.
+
+    With NumPy the corpus is indexed once up front: every position's pair
+    is encoded as an int and the positions are sorted by pair (stably, so
+    each pair's positions stay in order). Fetching a prefix binary
+    searches for its run of positions and ranks the characters that
+    follow them. Without NumPy (or with `backend` 'python') there is no
+    up front work: a prefix's positions are found by str.find the first
+    time it is fetched. Either way possibles are ranked exactly as
+    process_corpus ranks them, and a short game only pays for the prefixes
+    it asks about.
+
+    >>> corpus = 'through tough thorough thought though'
+    >>> for backend in ('numpy', 'python'):
+    ...     model = LazyModel(corpus, backend)
+    ...     print(model.fetch('th'), model.fetch('h '), model.fetch('zz'))
+    SFL(<'o': 3>, <'r': 1>) SFL(<'t': 3>) None
+    SFL(<'o': 3>, <'r': 1>) SFL(<'t': 3>) None
+    >>> model.fetch('th') is model.fetch('th')
+    True
+    >>> model.n_fetched
+    3
+    """
+
+    prefix_len = 2
+
+    def __init__(self, corpus, backend=None):
+        if backend is None:
+            backend = 'python' if np is None else 'numpy'
+        if backend not in ('python', 'numpy'):
+            raise ValueError('unknown backend: {!r}'.format(backend))
+        if backend == 'numpy' and np is None:
+            raise ImportError("the 'numpy' backend needs NumPy installed")
+        self.corpus = corpus
+        self.backend = backend
+        self.tail = corpus[-self.prefix_len:]
+        # prefix -> PossiblesView, or None for a prefix not in the corpus
+        self._possibles = {}
+        self._n_positions = max(0, len(corpus) - self.prefix_len)
+        if backend == 'numpy' and self._n_positions:
+            self._index()
+
+    @property
+    def n_fetched(self):
+        """The number of prefixes worked out so far"""
+        return len(self._possibles)
+
+    def _index(self):
+        n_positions = self._n_positions
+        codes = np.frombuffer(self.corpus.encode('utf-32-le'), dtype='<u4')
+        self._alphabet, codes = np.unique(codes, return_inverse=True)
+        size = len(self._alphabet)
+        self._codes = {chr(code): index for index, code
+                       in enumerate(self._alphabet.tolist())}
+        self._followers = codes[2:].astype(np.uint32)
+        pairs = (codes[:n_positions].astype(np.int64) * size +
+                 codes[1:n_positions + 1])
+        self._order = np.argsort(pairs, kind='stable').astype(np.uint32)
+        self._pairs = pairs[self._order]
+
+    def _rank_numpy(self, prefix):
+        first, second = (self._codes.get(char) for char in prefix)
+        if first is None or second is None:
+            return None
+        pair = first * len(self._alphabet) + second
+        start = np.searchsorted(self._pairs, pair, 'left')
+        stop = np.searchsorted(self._pairs, pair, 'right')
+        if start == stop:
+            return None
+        followers = self._followers[self._order[start:stop]]
+        letters, inverse, counts = np.unique(followers, return_inverse=True,
+                                             return_counts=True)
+        last_seen = np.zeros(len(letters), dtype=np.int64)
+        np.maximum.at(last_seen, inverse, np.arange(len(followers)))
+        ranked = np.lexsort((last_seen, -counts))
+        return PossiblesView(array('I', self._alphabet[letters[ranked]]
+                                   .tolist()),
+                             array('I', counts[ranked].tolist()))
+
+    def _rank_python(self, prefix):
+        corpus = self.corpus
+        end = self._n_positions + self.prefix_len - 1
+        counts = {}
+        last_seen = {}
+        position = corpus.find(prefix, 0, end)
+        while position >= 0:
+            letter = corpus[position + self.prefix_len]
+            counts[letter] = counts.get(letter, 0) + 1
+            last_seen[letter] = position
+            position = corpus.find(prefix, position + 1, end)
+        if not counts:
+            return None
+        ranked = sorted(counts, key=lambda letter: (-counts[letter],
+                                                    last_seen[letter]))
+        return PossiblesView(array('I', map(ord, ranked)),
+                             array('I', [counts[letter]
+                                         for letter in ranked]))
+
+    def fetch(self, prefix):
+        """
+        Returns a PossiblesView of the possibles for `prefix`, or None if
+        the `prefix` isn't in the corpus.
+        """
+        try:
+            return self._possibles[prefix]
+        except KeyError:
+            pass
+        if len(prefix) != self.prefix_len or not self._n_positions:
+            possibles = None
+        elif self.backend == 'numpy':
+            possibles = self._rank_numpy(prefix)
+        else:
+            possibles = self._rank_python(prefix)
+        self._possibles[prefix] = possibles
+        return possibles
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+    def items(self):
+        """
+        Yields (prefix, possibles) for each prefix in the corpus, working
+        out (and remembering) every one of them.
+        """
+        corpus = self.corpus
+        prefixes = dict.fromkeys(corpus[position:position + self.prefix_len]
+                                 for position in range(self._n_positions))
+        for prefix in prefixes:
+            yield prefix, self.fetch(prefix)
+
+
+def run_lazy_trials(filenames=TEST_FILES, phrase=TEST_PHRASES[0]):
+    """
+    Times how long it takes from having the formatted text of each file in
+    `filenames` to knowing the score of `phrase`, building a full
+    GrowablePrefixTable first or using a LazyModel with each backend.
+    """
+    backends = ['python'] + ([] if np is None else ['numpy'])
+    print('{:>28} {:>10}'.format('corpus', 'table s') +
+          ''.join(' {:>10}'.format('lazy ' + backend)
+                  for backend in backends))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        timings = []
+        builders = [lambda: process_corpus(corpus, None, growable=True)]
+        builders += [lambda backend=backend: LazyModel(corpus, backend)
+                     for backend in backends]
+        scores = set()
+        for build in builders:
+            start = time.perf_counter()
+            scores.add(score_phrase(build(), phrase))
+            timings.append(time.perf_counter() - start)
+        assert len(scores) == 1
+        print('{:>28}'.format(corpus_filename) +
+              ''.join(' {:10.4f}'.format(seconds) for seconds in timings))
+
+
+def _suffix_array(corpus):
+    """
+    Returns the start of every suffix of `corpus` in sorted order of the
+    suffixes, as an array of unsigned ints, by prefix doubling: suffixes
+    are sorted by their first character, then by their first 2, 4, 8...
+    characters until every rank is distinct, each round sorting on the
+    pair of ranks k characters apart. Uses NumPy if it is installed.
+
+    >>> list(_suffix_array('banana'))
+    [5, 3, 1, 0, 4, 2]
+    """
+    n_chars = len(corpus)
+    if n_chars == 0:
+        return array('I')
+    if np is not None:
+        codes = np.frombuffer(corpus.encode('utf-32-le'), dtype='<u4')
+        rank = np.unique(codes, return_inverse=True)[1].astype(np.int64)
+        step = 1
+        while True:
+            following = np.full(n_chars, -1, dtype=np.int64)
+            following[:n_chars - step] = rank[step:]
+            keys = rank * (n_chars + 1) + following + 1
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            ranks = np.concatenate(([0], np.cumsum(keys[1:] != keys[:-1])))
+            rank[order] = ranks
+            if ranks[-1] == n_chars - 1 or step >= n_chars:
+                break
+            step *= 2
+        suffixes = array('I')
+        suffixes.frombytes(order.astype(np.uint32).tobytes())
+        return suffixes
+
+    letters = sorted(set(corpus))
+    codes = {letter: code for code, letter in enumerate(letters)}
+    rank = [codes[char] for char in corpus]
+    step = 1
+    while True:
+        keys = [(rank[position], rank[position + step]
+                 if position + step < n_chars else -1)
+                for position in range(n_chars)]
+        order = sorted(range(n_chars), key=keys.__getitem__)
+        new_rank = 0
+        rank[order[0]] = 0
+        for previous, position in zip(order, order[1:]):
+            if keys[position] != keys[previous]:
+                new_rank += 1
+            rank[position] = new_rank
+        if new_rank == n_chars - 1 or step >= n_chars:
+            break
+        step *= 2
+    return array('I', order)
+
+
+# SuffixModel keeps the largest suffix start of each block of this many
+_RANGE_BLOCK = 64
+
+
+class SuffixModel(object):
+    """
+    A model that predicts from the longest end of the text so far (up to
+    `max_context` characters) that appears anywhere in `corpus` followed
+    by something, rather than from a fixed two characters.
+
+    The corpus is kept as is, with a suffix array of 4 bytes per
+    character. Whether a context appears is a binary search of the suffix
+    array, and since every shorter end of a context that appears also
+    appears, the longest is found by a binary search over lengths. All the
+    suffixes starting with the context are then next to each other,
+    grouped by the character after it, so each group is found by another
+    binary search and its count is its size. Letters with the same count
+    are ranked by where they last followed the context, as
+    process_corpus ranks them, which is the largest start in the group's
+    part of the suffix array. That comes from a sparse table of the
+    largest start in each block of _RANGE_BLOCK entries (and in each run
+    of 2, 4, 8... blocks) plus a scan of at most a block at either end,
+    which adds a few bytes per block rather than per character. So a
+    lookup takes time logarithmic in the size of the corpus, whatever the
+    number of times the context appears.
+
+    fetch(prefix) gives the possibles for the longest matching end of
+    `prefix`, and prefix_len is `max_context`, so it plugs into play_game
+    and the other users of fetch. Games still start from the first
+    seed_len (2) characters of the phrase.
+
+    >>> corpus = 'through tough thorough thought though'
+    >>> model = SuffixModel(corpus)
+    >>> model.match('a thou')
+    (' thou', SFL(<'g': 2>))
+    >>> model.fetch('a thou')
+    SFL(<'g': 2>)
+    >>> model.match('qth')
+    ('th', SFL(<'o': 3>, <'r': 1>))
+    >>> list(model.fetch('th')) == list(process_corpus(corpus, 7).fetch('th'))
+    True
+    >>> model.match('q')
+    ('', None)
+    >>> score_phrase(model, 'thought'), score_phrase(process_corpus(corpus, 7),
+    ...                                              'thought')
+    (5, 6)
+    """
+
+    seed_len = 2
+
+    def __init__(self, corpus, max_context=64):
+        self.corpus = corpus
+        self.prefix_len = max_context
+        self.tail = corpus[-max_context:]
+        self.suffixes = _suffix_array(corpus)
+        # _block_max[level][block] is the largest start in the 2**level
+        # blocks from `block` on
+        suffixes = self.suffixes
+        level = array('I', (max(suffixes[start:start + _RANGE_BLOCK])
+                            for start in range(0, len(suffixes),
+                                               _RANGE_BLOCK)))
+        self._block_max = [level]
+        n_blocks = len(level)
+        width = 1
+        while 2 * width <= n_blocks:
+            level = array('I', map(max, level, level[width:]))
+            self._block_max.append(level)
+            width *= 2
+
+    def _last_start(self, first, stop):
+        """Returns the largest start in suffixes[first:stop]"""
+        suffixes = self.suffixes
+        first_block = -(-first // _RANGE_BLOCK)
+        stop_block = stop // _RANGE_BLOCK
+        if first_block >= stop_block:
+            return max(suffixes[first:stop])
+        level = (stop_block - first_block).bit_length() - 1
+        block_max = self._block_max[level]
+        last = max(block_max[first_block],
+                   block_max[stop_block - (1 << level)])
+        if first < first_block * _RANGE_BLOCK:
+            last = max(last, max(suffixes[first:
+                                          first_block * _RANGE_BLOCK]))
+        if stop_block * _RANGE_BLOCK < stop:
+            last = max(last, max(suffixes[stop_block * _RANGE_BLOCK:stop]))
+        return last
+
+    def _bounds(self, text, start=0, stop=None):
+        """
+        Returns the range of the suffix array (within start:stop) holding
+        the suffixes that start with `text`.
+        """
+        corpus, suffixes, length = self.corpus, self.suffixes, len(text)
+        low, high = start, len(suffixes) if stop is None else stop
+        while low < high:
+            middle = (low + high) // 2
+            position = suffixes[middle]
+            if corpus[position:position + length] < text:
+                low = middle + 1
+            else:
+                high = middle
+        first = low
+        high = len(suffixes) if stop is None else stop
+        while low < high:
+            middle = (low + high) // 2
+            position = suffixes[middle]
+            if corpus[position:position + length] <= text:
+                low = middle + 1
+            else:
+                high = middle
+        return first, low
+
+    def _followed(self, text):
+        """
+        Returns the range of the suffix array holding the suffixes that
+        start with `text` and carry on past it.
+        """
+        first, stop = self._bounds(text)
+        # A suffix that is exactly `text` sorts first
+        if first < stop and self.suffixes[first] == len(self.corpus) - len(
+                text):
+            first += 1
+        return first, stop
+
+    def match(self, progress):
+        """
+        Returns (context, possibles): the longest end of `progress` (up to
+        max_context characters) that is followed by something in the
+        corpus, and a PossiblesView of what follows it, or ('', None) if
+        not even the last character of `progress` is.
+        """
+        progress = progress[-self.prefix_len:]
+        # The longest length known to match, and one more than the longest
+        # that might
+        shortest, longest = 0, len(progress) + 1
+        bounds = None
+        while longest - shortest > 1:
+            length = (shortest + longest) // 2
+            first, stop = self._followed(progress[len(progress) - length:])
+            if first < stop:
+                shortest, bounds = length, (first, stop)
+            else:
+                longest = length
+        if bounds is None:
+            return '', None
+        context = progress[len(progress) - shortest:]
+        return context, self._possibles(len(context), *bounds)
+
+    def _possibles(self, length, first, stop):
+        corpus, suffixes = self.corpus, self.suffixes
+        followers = []
+        while first < stop:
+            letter = corpus[suffixes[first] + length]
+            # Find the end of this letter's group
+            low, high = first + 1, stop
+            while low < high:
+                middle = (low + high) // 2
+                if corpus[suffixes[middle] + length] <= letter:
+                    low = middle + 1
+                else:
+                    high = middle
+            followers.append((-(low - first), self._last_start(first, low),
+                              letter))
+            first = low
+        followers.sort()
+        return PossiblesView(array('I', [ord(letter) for _, _, letter
+                                         in followers]),
+                             array('I', [-count for count, _, _
+                                         in followers]))
+
+    def fetch(self, prefix):
+        """
+        Returns a PossiblesView of the possibles for the longest matching
+        end of `prefix`, or None if none of it matches.
+        """
+        return self.match(prefix)[1]
+
+    def __contains__(self, prefix):
+        return self.fetch(prefix) is not None
+
+
+def run_suffix_trials(filenames=TEST_FILES, n_phrases=200, phrase_len=40,
+                      max_contexts=(2, 4, 8, 64)):
+    """
+    Builds a SuffixModel of each file in `filenames` and prints how long
+    it took, how many bytes it uses per corpus character and, for each
+    of `max_contexts`, the mean guesses per character over `n_phrases`
+    phrases of `phrase_len` characters taken from evenly spaced places in
+    the file, alongside the two character table's.
+    As the phrases come from the corpus, long contexts help more than
+    they would on new text.
+    """
+    print('{:>28} {:>8} {:>7} {:>8}'.format('corpus', 'build s', 'B/char',
+                                           'table') +
+          ''.join(' {:>8}'.format('max {}'.format(max_context))
+                  for max_context in max_contexts))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        step = max(1, (len(corpus) - phrase_len) // n_phrases)
+        phrases = [corpus[start:start + phrase_len]
+                   for start in range(0, len(corpus) - phrase_len + 1,
+                                      step)][:n_phrases]
+        start = time.perf_counter()
+        model = SuffixModel(corpus)
+        build_time = time.perf_counter() - start
+        n_bytes = (sys.getsizeof(corpus) +
+                   model.suffixes.itemsize * len(model.suffixes))
+        means = []
+        _, counts, _ = play_games(process_corpus(corpus, None, growable=True),
+                                  phrases)
+        means.append(sum(counts) / max(1, len(counts)))
+        for max_context in max_contexts:
+            model.prefix_len = max_context
+            _, counts, _ = play_games(model, phrases)
+            means.append(sum(counts) / max(1, len(counts)))
+        print('{:>28} {:8.3f} {:7.1f}'.format(
+            corpus_filename, build_time, n_bytes / max(1, len(corpus))) +
+              ''.join(' {:8.3f}'.format(mean) for mean in means))
+
+
+def run_memory_trials(filenames=TEST_FILES):
+    """
+    Builds the model for each file in `filenames` as a GrowablePrefixTable
+    and as a CompactPrefixTable and prints how much memory each takes per
+    distinct (prefix, follower) pair, as measured by tracemalloc.
+    """
+    print('{:>28} {:>10} {:>14} {:>14}'.format(
+        'corpus', 'pairs', 'table B/pair', 'compact B/pair'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        tracemalloc.start()
+        table = process_corpus(corpus, None, growable=True)
+        table_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tracemalloc.start()
+        compact = CompactPrefixTable(table)
+        compact_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:>28} {:10} {:14.1f} {:14.1f}'.format(
+            corpus_filename, compact.n_pairs,
+            table_memory / compact.n_pairs, compact_memory / compact.n_pairs))
+        del table, compact
+
+
+def run_top_k_trials(filenames=TEST_FILES, ks=(1, 2, 4, 8, 16),
+                     n_phrases=500, phrase_len=40):
+    """
+    Builds the exact model and a top_k model for each k in `ks` for each
+    file in `filenames`, plays `n_phrases` phrases of `phrase_len`
+    characters taken from evenly spaced places in the corpus against each
+    model, and prints the memory each model uses (as estimated by
+    model_nbytes) next to how its guess counts differ from the exact
+    model's: the mean guesses per character, the change in the total, the
+    share of characters that took a different number of guesses and the
+    number of phrases given up on.
+    """
+    print('{:>28} {:>5} {:>10} {:>8} {:>10} {:>8} {:>8} {:>6}'.format(
+        'corpus', 'k', 'MiB', 'pairs', 'guess/chr', 'total', 'changed',
+        'lost'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        step = max(1, (len(corpus) - phrase_len) // n_phrases)
+        phrases = [corpus[start:start + phrase_len]
+                   for start in range(0, len(corpus) - phrase_len + 1,
+                                      step)][:n_phrases]
+        exact = process_corpus(corpus, None, growable=True)
+        exact_totals, exact_counts, exact_offsets = play_games(exact,
+                                                               phrases)
+        for k in (None,) + tuple(ks):
+            if k is None:
+                model = exact
+                totals, counts, offsets = (exact_totals, exact_counts,
+                                           exact_offsets)
+            else:
+                model = process_corpus(corpus, None, growable=True, top_k=k)
+                totals, counts, offsets = play_games(model, phrases)
+            n_pairs = sum(len(possibles) for _, possibles in model.items())
+            guesses = n_chars = changed = 0
+            difference = lost = 0
+            for phrase in range(len(phrases)):
+                if totals[phrase] < 0 or exact_totals[phrase] < 0:
+                    lost += totals[phrase] < 0
+                    continue
+                difference += totals[phrase] - exact_totals[phrase]
+                guesses += totals[phrase]
+                ours = counts[offsets[phrase]:offsets[phrase + 1]]
+                theirs = exact_counts[exact_offsets[phrase]:
+                                      exact_offsets[phrase + 1]]
+                n_chars += len(ours)
+                changed += sum(mine != exact_count
+                               for mine, exact_count in zip(ours, theirs))
+            base = sum(total for total in exact_totals if total >= 0)
+            print('{:>28} {:>5} {:10.2f} {:8} {:10.3f} {:+7.1%} {:8.1%} '
+                  '{:6}'.format(corpus_filename, 'all' if k is None else k,
+                                model_nbytes(model) / 2**20, n_pairs,
+                                guesses / max(1, n_chars),
+                                difference / max(1, base),
+                                changed / max(1, n_chars), lost))
+        del exact
+
+
+def model_nbytes(model):
+    """
+    Returns a rough count of the bytes of memory `model` takes up: the size
+    of the mapped file for a CompiledModel, the size of the arrays for a
+    CompactPrefixTable, otherwise the size of the table
+    and everything in it as measured by sys.getsizeof.
+    """
+    if isinstance(model, CompiledModel):
+        return len(model._mmap)
+    if isinstance(model, CompactPrefixTable):
+        return sys.getsizeof(model) + model.nbytes()
+    total = sys.getsizeof(model) + sys.getsizeof(model.data)
+    for prefix, possibles in model.items():
+        total += (sys.getsizeof(PrefixItem(prefix, possibles)) +
+                  sys.getsizeof(prefix) + sys.getsizeof(possibles) +
+                  sys.getsizeof(possibles._index) +
+                  sys.getsizeof(possibles._bucket_heads))
+        for letter, frequency in possibles.items():
+            total += (sys.getsizeof(Frequency(letter, frequency)) +
+                      sys.getsizeof(letter))
+    return total
+
+
+class ModelCache(object):
+    """
+    Keeps the models built from corpus files so playing against the same
+    corpus again never rebuilds its table.
+
+    Models are keyed on a SHA-256 of the file's content together with the
+    build settings (prefix length and normaliser and model format versions),
+    so a renamed copy of a corpus is a hit and an edited one is a miss.
+    The most recently used models are kept in memory up to `max_bytes`
+    (as estimated by model_nbytes). If a `directory` is given, every model
+    built is also compiled there and later loaded from there when it isn't
+    in memory, including by other processes.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> corpus_filename = os.path.join(directory.name, 'pitter.txt')
+    >>> with open(corpus_filename, 'wb') as outfile:
+    ...     _ = outfile.write('Pitter patter, \u00e9t\u00e9'.encode('utf-8'))
+    >>> cache = ModelCache(directory=directory.name)
+    >>> cache.load(corpus_filename).fetch('tt')
+    SFL(<'e': 2>)
+    >>> cache.load(corpus_filename).fetch(' \xe9')
+    SFL(<'t': 1>)
+    >>> cache.load(corpus_filename).fetch('tt')
+    SFL(<'e': 2>)
+    >>> model = ModelCache(directory=directory.name).load(corpus_filename)
+    >>> type(model).__name__, list(model.fetch('tt'))
+    ('CompiledModel', ['e'])
+    >>> stats = cache.stats()
+    >>> stats['memory_hits'], stats['disk_hits'], stats['misses']
+    (2, 0, 1)
+    >>> model.close()
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._models = OrderedDict()
+        self._n_bytes = 0
+        # (filename, mtime, size) -> content digest, to skip re-hashing
+        self._digests = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.build_time = 0.0
+
+    def key(self, corpus_filename):
+        """Returns the cache key for the current content of a corpus file"""
+        status = os.stat(corpus_filename)
+        file_id = (os.path.abspath(corpus_filename), status.st_mtime_ns,
+                   status.st_size)
+        digest = self._digests.get(file_id)
+        if digest is None:
+            content = hashlib.sha256()
+            with open(corpus_filename, 'rb') as infile:
+                for block in iter(lambda: infile.read(1 << 20), b''):
+                    content.update(block)
+            digest = content.hexdigest()
+            self._digests[file_id] = digest
+        return '{}-p{}-n{}-m{}'.format(digest, PrefixTable.prefix_len,
+                                       NORMALIZER_VERSION, _MODEL_VERSION)
+
+    def _remember(self, key, model):
+        """Adds `model` to the memory tier, evicting the least recently
+        used models until it fits the byte budget.
+        """
+        n_bytes = model_nbytes(model)
+        self._models[key] = (model, n_bytes)
+        self._n_bytes += n_bytes
+        while self._n_bytes > self.max_bytes and len(self._models) > 1:
+            _, (_, evicted_bytes) = self._models.popitem(last=False)
+            self._n_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def load(self, corpus_filename):
+        """
+        Returns the model for `corpus_filename` from memory, from disk or by
+        building it, in that order of preference.
+        """
+        key = self.key(corpus_filename)
+        entry = self._models.get(key)
+        if entry is not None:
+            self._models.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+        if self.directory is not None:
+            model_filename = os.path.join(self.directory, key + '.model')
+            if os.path.exists(model_filename):
+                model = CompiledModel(model_filename)
+                self.disk_hits += 1
+                self._remember(key, model)
+                return model
+        self.misses += 1
+        start = time.perf_counter()
+        with CorpusSource(corpus_filename) as source:
+            corpus = read_formatted(source)
+        model = process_corpus(corpus, None, growable=True,
+                               backend='python' if np is None else 'numpy')
+        self.build_time += time.perf_counter() - start
+        if self.directory is not None:
+            compile_table(model, model_filename)
+        self._remember(key, model)
+        return model
+
+    def combined(self, corpus_filenames, weights=None):
+        """
+        Returns merge_models of the models for every file in
+        `corpus_filenames`, loading each through the cache, so changing the
+        mix only rebuilds the books not seen before.
+        """
+        return merge_models([self.load(corpus_filename)
+                             for corpus_filename in corpus_filenames],
+                            weights)
+
+    def stats(self):
+        """Returns the hit, miss and size statistics as a dict"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': ((self.memory_hits + self.disk_hits) / lookups
+                             if lookups else 0.0),
+                'evictions': self.evictions,
+                'models': len(self._models),
+                'bytes': self._n_bytes,
+                'build_time': self.build_time}
+
+    def report(self):
+        """Prints the statistics"""
+        print('Model cache')
+        print('-----------')
+        for name, value in self.stats().items():
+            if isinstance(value, float):
+                value = '{:.3f}'.format(value)
+            print('{:>12}: {}'.format(name, value))
+
+
+def synthetic_corpus(size, alphabet_size=27, seed=0):
+    """
+    Returns `size` characters of made up text for timing trials: words
+    built from the first `alphabet_size` - 1 letters of a pool of Latin,
+    Greek and Cyrillic letters, separated by spaces and the odd bit of
+    punctuation, with common words much more common than rare ones.
+    The same arguments always give the same text.
+
+    >>> text = synthetic_corpus(60, 5, seed=1)
+    >>> len(text), sorted(set(text) - set(' ,.'))
+    (60, ['a', 'b', 'c', 'd'])
+    >>> text == synthetic_corpus(60, 5, seed=1)
+    True
+    """
+    pool = ('abcdefghijklmnopqrstuvwxyz' +
+            ''.join(chr(code) for code in range(0xe0, 0xff) if code != 0xf7) +
+            ''.join(chr(code) for code in range(0x3b1, 0x3ca)) +
+            ''.join(chr(code) for code in range(0x430, 0x450)))
+    if not 2 <= alphabet_size <= len(pool) + 1:
+        raise ValueError('alphabet_size must be between 2 and {}'.format(
+            len(pool) + 1))
+    letters = pool[:alphabet_size - 1]
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(letters)
+                          for _ in range(rng.randint(1, 9)))
+                  for _ in range(2000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    pieces = []
+    length = 0
+    while length < size:
+        for word in rng.choices(vocabulary, weights, k=1000):
+            separator = rng.choice(' ' * 10 + ',.')
+            piece = word + separator if separator == ' ' else \
+                word + separator + ' '
+            pieces.append(piece)
+            length += len(piece)
+    return ''.join(pieces)[:size]
+
+
+def time_trial(document, phrase, backend='python', n_lookups=10000):
+    """
+    Runs each stage of the game on the raw text `document` and returns a
+    dict with the seconds taken to format it, to build its table with the
+    given `backend`, to look up `n_lookups` prefixes from it and to play
+    `phrase` (quietly), along with the formatted size and guesses taken.
+
+    >>> trial = time_trial('1234', 'ab')
+    >>> trial['formatted_size'], trial['guesses']
+    (0, 0)
+    """
+    start = time.perf_counter()
+    corpus = format_document(document)
+    normalize_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = process_corpus(corpus, None, growable=True, backend=backend)
+    build_time = time.perf_counter() - start
+
+    n_positions = max(1, len(corpus) - 1)
+    prefixes = [corpus[position:position + 2] for position in
+                (i * 7919 % n_positions for i in range(n_lookups))]
+    start = time.perf_counter()
+    for prefix in prefixes:
+        table.fetch(prefix)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    guesses = score_phrase(table, phrase)
+    game_time = time.perf_counter() - start
+
+    return {'formatted_size': len(corpus), 'normalize': normalize_time,
+            'build': build_time, 'lookup': lookup_time, 'game': game_time,
+            'guesses': guesses}
+
+
+# The timings compared between runs by compare_trials
+TRIAL_TIMINGS = ('normalize', 'build', 'lookup', 'game')
+
+
+def compare_trials(results, baseline, tolerance=0.25, min_seconds=0.001):
+    """
+    Compares two lists of trial results (as made by run_time_trials) and
+    returns a list of the regressions: a dict for each timing in `results`
+    more than `tolerance` (as a fraction) slower than the same trial in
+    `baseline`. Differences of less than `min_seconds` are ignored as
+    noise, as are trials missing from either list.
+
+    >>> old = [{'source': 'a', 'size': 10, 'alphabet': 27, 'normalize': 1.0,
+    ...         'build': 2.0, 'lookup': 0.1, 'game': 0.0001}]
+    >>> new = [dict(old[0], build=3.0, lookup=0.11, game=0.0009)]
+    >>> compare_trials(new, old)  # doctest: +NORMALIZE_WHITESPACE
+    [{'source': 'a', 'size': 10, 'alphabet': 27, 'timing': 'build',
+      'baseline': 2.0, 'current': 3.0, 'ratio': 1.5}]
+    """
+    def trial_key(result):
+        return result['source'], result['size'], result['alphabet']
+
+    previous = {trial_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(trial_key(result))
+        if old is None:
+            continue
+        for timing in TRIAL_TIMINGS:
+            before, after = old.get(timing), result.get(timing)
+            if before is None or after is None:
+                continue
+            if (after > before * (1 + tolerance) and
+                    after - before >= min_seconds):
+                regressions.append({'source': result['source'],
+                                    'size': result['size'],
+                                    'alphabet': result['alphabet'],
+                                    'timing': timing,
+                                    'baseline': before, 'current': after,
+                                    'ratio': round(after / before, 3)})
+    return regressions
+
+
+def run_time_trials(filenames=TEST_FILES,
+                    slice_sizes=range(1000, 240000, 10000),
+                    synthetic_sizes=(10000, 100000, 1000000),
+                    alphabet_sizes=(27, 60),
+                    phrase='The quick brown fox jumps over the lazy dog',
+                    backend='python', output=None, baseline=None,
+                    tolerance=0.25):
+    """
+    Times formatting, table building, lookups and game play (see
+    time_trial) for:
+      each file in `filenames` cut to each of `slice_sizes` characters and
+      in full, giving scaling curves for real text (missing files are
+      skipped);
+      synthetic_corpus text of each of `synthetic_sizes` characters with
+      each of `alphabet_sizes`.
+    Prints a table of the results and returns them as a list of dicts.
+    If `output` is given the results are also saved there as JSON.
+    If `baseline` names a JSON file saved earlier, the results are compared
+    with it and any timing more than `tolerance` slower is reported.
+    """
+    trials = []
+    for corpus_filename in filenames:
+        if not os.path.exists(corpus_filename):
+            print('Skipping missing corpus ' + corpus_filename)
+            continue
+        with open(corpus_filename) as infile:
+            document = infile.read()
+        for size in list(slice_sizes) + [len(document)]:
+            if size <= len(document):
+                trials.append((corpus_filename, size, 0, document[:size]))
+    for size in synthetic_sizes:
+        for alphabet_size in alphabet_sizes:
+            trials.append(('synthetic', size, alphabet_size,
+                           synthetic_corpus(size, alphabet_size)))
+
+    results = []
+    print('{:>28} {:>9} {:>5} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+        'source', 'size', 'alpha', 'normalize', 'build', 'lookup', 'game',
+        'guesses'))
+    for source, size, alphabet_size, document in trials:
+        result = time_trial(document, phrase, backend)
+        result.update(source=source, size=size, alphabet=alphabet_size)
+        results.append(result)
+        print('{:>28} {:9} {:5} {:9.4f} {:9.4f} {:9.4f} {:9.6f} {:>7}'.format(
+            source, size, alphabet_size, result['normalize'],
+            result['build'], result['lookup'], result['game'],
+            str(result['guesses'])))
+
+    if output is not None:
+        with open(output, 'w') as outfile:
+            json.dump({'python': platform.python_version(),
+                       'backend': backend, 'phrase': phrase,
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, outfile, indent=1)
+    if baseline is not None:
+        with open(baseline) as infile:
+            previous = json.load(infile)['results']
+        regressions = compare_trials(results, previous, tolerance)
+        if not regressions:
+            print('No regressions against ' + baseline)
+        for regression in regressions:
+            print('REGRESSION {source} {size} {alphabet} {timing}: '
+                  '{baseline:.6f} -> {current:.6f} ({ratio}x)'.format(
+                      **regression))
+    return results
+
+
+class Instrumentation(object):
+    """
+    Counts what the hot paths are doing while enabled, for finding out why
+    a corpus is slow:
+      probe_lengths: how many slots each PrefixTable fetch looked at;
+      bucket_hops: how many frequency buckets each SortedFrequencyList
+      placement hopped over;
+      adds, reorders and placements: SortedFrequencyList.add calls, those
+      that moved an existing letter, and move_node_to_place calls;
+      phases: calls to and seconds spent in format_document,
+      process_corpus and play_game, and in DocumentNormalizer.feed
+      (as normalizer), which formats ASCII pieces without calling
+      format_document but includes its calls for decoded ones.
+    Enabling swaps instrumented versions into the classes and module, and
+    disabling swaps the originals back, so none of it costs anything when
+    it isn't in use. Only one Instrumentation can be enabled at a time.
+
+    >>> with Instrumentation() as stats:
+    ...     _ = time_trial('Ab ac ad ad', 'ab ac', n_lookups=0)
+    >>> counts = stats.as_dict()
+    >>> counts['phases']['process_corpus']['calls']
+    1
+    >>> counts['adds'], counts['placements'], counts['reorders']
+    (9, 8, 1)
+    >>> counts['probe_lengths']
+    {1: 9, 2: 3}
+    >>> _ = time_trial('Ab ac ad ad', 'ab ac', n_lookups=0)
+    >>> stats.as_dict()['adds']
+    9
+    >>> with Instrumentation() as stats:
+    ...     _ = DocumentNormalizer().feed(memoryview(b'Ab  AC'))
+    >>> phases = stats.as_dict()['phases']
+    >>> phases['normalizer']['calls'], phases['format_document']['calls']
+    (1, 0)
+    """
+
+    PHASES = ('format_document', 'process_corpus', 'play_game')
+
+    def __init__(self):
+        self.probe_lengths = Counter()
+        self.bucket_hops = Counter()
+        self.adds = 0
+        self.reorders = 0
+        self.placements = 0
+        self.phases = {name: [0, 0.0]
+                       for name in ('normalizer',) + self.PHASES}
+        self._originals = None
+
+    def _instrumented_fetch(self, original):
+        stats = self
+
+        def fetch(table, prefix, hash_value=None):
+            stats.probe_lengths[table._probe_length(prefix, hash_value)] += 1
+            return original(table, prefix, hash_value)
+        return fetch
+
+    def _instrumented_methods(self):
+        stats = self
+        original_add = SortedFrequencyList.add
+        original_place = SortedFrequencyList.move_node_to_place
+
+        def add(possibles, letter, frequency=1):
+            stats.adds += 1
+            node = possibles._index.get(letter)
+            previous = None if node is None else node.prev
+            original_add(possibles, letter, frequency)
+            if node is not None and node.prev is not previous:
+                stats.reorders += 1
+
+        def move_node_to_place(possibles, freq_node):
+            stats.placements += 1
+            original_place(possibles, freq_node)
+
+        def _last_at_least(possibles, start, frequency):
+            current = start
+            hops = 0
+            while current is not None and current.frequency < frequency:
+                current = possibles._bucket_heads[current.frequency].prev
+                hops += 1
+            stats.bucket_hops[hops] += 1
+            return current
+
+        return [(PrefixTable, 'fetch',
+                 self._instrumented_fetch(PrefixTable.fetch)),
+                (GrowablePrefixTable, 'fetch',
+                 self._instrumented_fetch(GrowablePrefixTable.fetch)),
+                (SortedFrequencyList, 'add', add),
+                (SortedFrequencyList, 'move_node_to_place',
+                 move_node_to_place),
+                (SortedFrequencyList, '_last_at_least', _last_at_least),
+                (DocumentNormalizer, 'feed',
+                 self._timed('normalizer', DocumentNormalizer.feed))]
+
+    def _timed(self, name, original):
+        phase = self.phases[name]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                phase[0] += 1
+                phase[1] += time.perf_counter() - start
+        return timed
+
+    def enable(self):
+        """Swaps the instrumented versions in"""
+        global _instrumentation
+        if _instrumentation is not None:
+            raise RuntimeError('instrumentation is already enabled')
+        self._originals = []
+        module = globals()
+        for owner, name, replacement in self._instrumented_methods():
+            self._originals.append((owner, name, owner.__dict__[name]))
+            setattr(owner, name, replacement)
+        for name in self.PHASES:
+            self._originals.append((None, name, module[name]))
+            module[name] = self._timed(name, module[name])
+        _instrumentation = self
+
+    def disable(self):
+        """Puts the originals back, keeping the counts so far"""
+        global _instrumentation
+        if self._originals is None:
+            return
+        module = globals()
+        for owner, name, original in reversed(self._originals):
+            if owner is None:
+                module[name] = original
+            else:
+                setattr(owner, name, original)
+        self._originals = None
+        _instrumentation = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def as_dict(self):
+        """Returns everything counted so far as a dict"""
+        return {'probe_lengths': dict(sorted(self.probe_lengths.items())),
+                'bucket_hops': dict(sorted(self.bucket_hops.items())),
+                'adds': self.adds,
+                'reorders': self.reorders,
+                'placements': self.placements,
+                'phases': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.phases.items()}}
+
+    def report(self):
+        """Prints everything counted so far"""
+        def histogram(title, counts):
+            total = sum(counts.values())
+            print(title)
+            if not total:
+                print('  (none)')
+            for length, count in sorted(counts.items()):
+                print('  {:>6}: {:>10} {:6.1%}'.format(length, count,
+                                                       count / total))
+        histogram('Probe lengths', self.probe_lengths)
+        histogram('Bucket hops', self.bucket_hops)
+        print('SFL adds: {}  reorders: {}  placements: {}'.format(
+            self.adds, self.reorders, self.placements))
+        print('Phases')
+        for name, (calls, seconds) in self.phases.items():
+            print('  {:>16}: {:6} calls {:10.4f} s'.format(name, calls,
+                                                          seconds))
+
+
+# The Instrumentation currently enabled, if any
+_instrumentation = None
+
+
+def run_some_trials():
+    """ Play some games with various test phrases and settings """
+    # play game using whatever you like
+    # maybe put an input statement here
+    # so you can enter the corpus
+    # and settings
+    # or just run various games with various settings
+
+    test_phrases = TEST_PHRASES
+
+    # MAKE SURE you test with various phrases!
+
+    test_files = TEST_FILES
+
+    # Each corpus is only processed the first time it's played
+    cache = ModelCache()
+
+    #Uncomment the block below to run trials based on the lists of phrases and files above
+    for test_phrase in test_phrases:
+        for corpus_filename in test_files:
+            phrase_length = 0   # for auto-run
+            load_corpus_and_play(corpus_filename, test_phrase, phrase_length,
+                                 cache=cache)
+            print('\n'*3)
+    cache.report()
+
+    # load_corpus_and_play(corpus_filename, 'ba', 7)
+
+
+def test():
+    """ Runs doctests """
+    # uncomment various doctest runs to check each method/function
+    # MAKE sure your submitted code doesn't run tests except
+    # MAKE SURE you add some doctests of your own to the docstrings
+
+    # doctest.run_docstring_examples(Frequency, globs=None)
+    # doctest.run_docstring_examples(FrequencyList.add, globs=None)
+    # doctest.run_docstring_examples(FrequencyList.remove, globs=None)
+    # doctest.run_docstring_examples(FrequencyList.find, globs=None)
+
+    # doctest.run_docstring_examples(filter_possible_chars, globs=None)
+    # doctest.run_docstring_examples(count_frequencies, globs=None)
+    # doctest.run_docstring_examples(select_next_guess, globs=None)
+
+    # you can leave the following line uncommented as long as your code
+    # passes all the tests the line won't produce any output
+    doctest.testmod()  # run all doctests - this is helpful before you submit
+
+    # Uncomment the call to run_some_trials below to run
+    # whatever trials you have setup in that function
+    # IMPORTANT: comment out the run_some_trials() line below
+    # before you submit your code
+    run_some_trials()
+
+    # IMPORTANT: comment out the run_time_trials() line below
+    # before you submit your code
+    run_time_trials()
+
+
+
+def fallback_guesses(possibles):
+    """
+    Returns all characters from a--z, and some punctuation that don't appear in
+    `possibles`.
+    """
+    possibles = set(possibles)
+    return [x for x in FALLBACKS if x not in possibles]
+
+
+def _rank_guesses(possibles):
+    """
+    Returns (guesses, n_corpus): a tuple of every guess to make, in order,
+    for a prefix with the given `possibles` (which may be None), and how
+    many of those guesses come from the corpus rather than the fallbacks.
+    """
+    corpus_guesses = () if possibles is None else tuple(possibles)
+    return (corpus_guesses + tuple(fallback_guesses(corpus_guesses)),
+            len(corpus_guesses))
+
+
+def _guess_counts(guesses, n_corpus):
+    """
+    Returns a dict mapping each of `guesses` to the number of guesses
+    guess_next_char takes to reach it, counting the extra guess spent
+    running out of corpus guesses for the fallbacks.
+    """
+    return {guess: rank + 1 if rank < n_corpus else rank + 2
+            for rank, guess in enumerate(guesses)}
+
+
+class GuessIndex(object):
+    """
+    Wraps a table (or any other model with fetch and prefix_len) and keeps
+    the full ranked sequence of guesses for each prefix, so it is only
+    worked out once per prefix rather than once per character guessed.
+    Prefixes the table doesn't have all share one precomputed sequence of
+    fallbacks. Sequences are worked out the first time a prefix is asked
+    for, or for every prefix in the table at once with precompute().
+
+    Alongside each sequence is a map from each letter to its position in
+    it, so guess_count answers how many guesses a letter takes without
+    stepping through the guesses before it.
+
+    >>> table = process_corpus('through tough thorough thought though', 7)
+    >>> index = GuessIndex(table)
+    >>> guesses, n_corpus = index.guesses('th')
+    >>> n_corpus, guesses[:6]
+    (2, ('o', 'r', 'a', 'b', 'c', 'd'))
+    >>> len(guesses) == len(FALLBACKS)
+    True
+    >>> index.guesses('zz') == (FALLBACKS, 0)
+    True
+    >>> index.guesses('th') is index.guesses('th')
+    True
+    >>> index.guess_count('th', 'r'), index.guess_count('th', 'a')
+    (2, 4)
+    >>> index.guess_count('zz', 'b'), index.guess_count('zz', '#')
+    (3, None)
+
+    With `cache_unseen` False, prefixes the table doesn't have aren't
+    remembered, so looking up made up prefixes doesn't grow the index.
+
+    >>> index = GuessIndex(table, cache_unseen=False)
+    >>> index.guesses('zz') == index.unseen, index.guesses('') == index.unseen
+    (True, True)
+    >>> index.n_cached
+    0
+    """
+
+    def __init__(self, table, cache_unseen=True):
+        self.table = table
+        self.cache_unseen = cache_unseen
+        self.prefix_len = table.prefix_len
+        self.seed_len = getattr(table, 'seed_len', table.prefix_len)
+        self.unseen = (FALLBACKS, 0)
+        self._unseen_counts = _guess_counts(FALLBACKS, 0)
+        self._guesses = {}
+        self._counts = {}
+
+    def _add(self, prefix, possibles):
+        if possibles is None:
+            if self.cache_unseen:
+                self._guesses[prefix] = self.unseen
+                self._counts[prefix] = self._unseen_counts
+        else:
+            entry = _rank_guesses(possibles)
+            self._guesses[prefix] = entry
+            self._counts[prefix] = _guess_counts(*entry)
+
+    def _lookup(self, prefix):
+        """Works out and returns (guesses, counts) for a prefix not in
+        the index yet.
+        """
+        possibles = self.table.fetch(prefix)
+        self._add(prefix, possibles)
+        if possibles is None:
+            return self.unseen, self._unseen_counts
+        return self._guesses[prefix], self._counts[prefix]
+
+    @property
+    def n_cached(self):
+        """The number of prefixes remembered"""
+        return len(self._guesses)
+
+    def precompute(self):
+        """Works out the guesses for every prefix in the table now"""
+        for prefix, possibles in self.table.items():
+            self._add(prefix, possibles)
+
+    def guesses(self, prefix):
+        """
+        Returns (guesses, n_corpus) for `prefix`: the tuple of every guess
+        in the order to try them, the first n_corpus of which come from the
+        corpus.
+        """
+        entry = self._guesses.get(prefix)
+        if entry is None:
+            entry = self._lookup(prefix)[0]
+        return entry
+
+    def guess_count(self, prefix, letter):
+        """
+        Returns the number of guesses guess_next_char takes in auto mode to
+        reach `letter` after `prefix`, or None if it never guesses it.
+        """
+        counts = self._counts.get(prefix)
+        if counts is None:
+            counts = self._lookup(prefix)[1]
+        return counts.get(letter)
+
+    def fetch(self, prefix):
+        """Returns the table's possibles for `prefix`"""
+        return self.table.fetch(prefix)
+
+    def __contains__(self, prefix):
+        return prefix in self.table
+
+
+class Predictor(object):
+    """
+    Answers "what comes next" for many contexts at once from `model` (a
+    PrefixTable or anything else with fetch, items and prefix_len).
+
+    Each prefix's possibles are turned into a tuple of (letter, probability)
+    pairs once, with the probabilities normalised to sum to one, and the
+    first k of them are kept for each k asked for, so a query is a slice
+    and a dict lookup that returns an existing tuple. Only the last
+    prefix_len characters of a context matter, and case doesn't.
+
+    >>> table = process_corpus('through tough thorough thought though', 7)
+    >>> predictor = Predictor(table)
+    >>> predictor.predict(['Th', 'a th', 'zz'], 1)
+    [(('o', 0.75),), (('o', 0.75),), ()]
+    >>> predictor.predict(['th'])
+    [(('o', 0.75), ('r', 0.25))]
+    >>> predictor.predict(['th'], 2)[0] is predictor.predict(['th'], 2)[0]
+    True
+    >>> predictor.predict(['', 'h'], 1)
+    [(), ()]
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.prefix_len = model.prefix_len
+        # prefix -> every (letter, probability) pair, most likely first
+        self._ranked = {}
+        # k -> prefix -> the first k pairs
+        self._top = {}
+
+    def _distribution(self, possibles):
+        if possibles is None:
+            return ()
+        items = list(possibles.items())
+        total = sum(count for _, count in items)
+        return tuple((letter, count / total) for letter, count in items)
+
+    def precompute(self):
+        """Works out the distribution for every prefix in the model now"""
+        for prefix, possibles in self.model.items():
+            self._ranked[prefix] = self._distribution(possibles)
+
+    def _add(self, prefix, k):
+        ranked = self._ranked.get(prefix)
+        if ranked is None:
+            ranked = self._distribution(self.model.fetch(prefix))
+            self._ranked[prefix] = ranked
+        top = ranked if k is None else ranked[:k]
+        self._top[k][prefix] = top
+        return top
+
+    def predict(self, contexts, k=None):
+        """
+        Returns a list with a tuple of (letter, probability) pairs for each
+        context in `contexts`: the `k` (or, if `k` is None, all) letters
+        most likely to follow it, most likely first. A context the model
+        knows nothing about, including an empty one, gets an empty tuple.
+        """
+        top = self._top.get(k)
+        if top is None:
+            top = self._top[k] = {}
+        prefix_len = self.prefix_len
+        get = top.get
+        results = [get(context[-prefix_len:].lower())
+                   for context in contexts]
+        if None in results:
+            for position, result in enumerate(results):
+                if result is None:
+                    prefix = contexts[position][-prefix_len:].lower()
+                    result = get(prefix)
+                    if result is None:
+                        result = self._add(prefix, k)
+                    results[position] = result
+        return results
+
+
+def run_predict_trials(filenames=TEST_FILES, n_contexts=100000, k=3):
+    """
+    Times Predictor.predict on `n_contexts` contexts taken from evenly
+    spaced places in each file in `filenames`, once cold and once with
+    every distribution worked out, against fetching each context's
+    possibles and building the top `k` list by hand, and prints the time
+    per context in microseconds.
+    """
+    print('{:>28} {:>10} {:>10} {:>10}'.format(
+        'corpus', 'fetch us', 'cold us', 'warm us'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            corpus = format_document(infile.read())
+        table = process_corpus(corpus, None, growable=True)
+        step = max(1, (len(corpus) - 10) // n_contexts)
+        contexts = [corpus[start:start + 10]
+                    for start in range(0, len(corpus) - 10, step)]
+        contexts = contexts[:n_contexts]
+
+        start = time.perf_counter()
+        for context in contexts:
+            possibles = table.fetch(context[-table.prefix_len:])
+            if possibles is not None:
+                list(possibles)[:k]
+        fetch_time = time.perf_counter() - start
+
+        predictor = Predictor(table)
+        start = time.perf_counter()
+        predictor.predict(contexts, k)
+        cold_time = time.perf_counter() - start
+        start = time.perf_counter()
+        predictor.predict(contexts, k)
+        warm_time = time.perf_counter() - start
+        print('{:>28} {:10.3f} {:10.3f} {:10.3f}'.format(
+            corpus_filename, *(seconds / len(contexts) * 1e6 for seconds in
+                               (fetch_time, cold_time, warm_time))))
+
+
+def reference_format_document(doc):
+    """
+    Re-formats `d` by collapsing all whitespace characters into a space and
+    stripping all characters that aren't letters or punctuation.
+    This is the original, character at a time version of format_document,
+    kept to check and time it against.
+    """
+    # http://www.unicode.org/reports/tr44/#General_Category_Values
+    allowed_types = _ALLOWED_CATEGORIES
+    #d = unicode(d, 'utf-8')
+    #d = str(d, 'utf-8')
+    # Collapse whitespace
+    doc = _WHITESPACE.sub(' ', doc)
+    doc = u''.join([cat.lower()
+                    for cat in doc if category(cat) in allowed_types])
+    # Remove .encode() to properly process a unicode corpus
+    return doc
+
+
+class _FormatTable(dict):
+    """
+    A str.translate table mapping each code point to its lower case form, or
+    to None if format_document drops it. Entries are looked up in the
+    Unicode database the first time a code point is seen, then cached.
+    """
+
+    def __missing__(self, code):
+        char = chr(code)
+        if category(char) in _ALLOWED_CATEGORIES:
+            value = char.lower()
+        else:
+            value = None
+        self[code] = value
+        return value
+
+
+_FORMAT_TABLE = _FormatTable()
+
+# The same decisions for ASCII, as arguments for bytes.translate
+_ASCII_TABLE = bytes(ord(chr(code).lower()) for code in range(256))
+_ASCII_DELETE = bytes(code for code in range(128)
+                      if category(chr(code)) not in _ALLOWED_CATEGORIES)
+# Lower cases like _ASCII_TABLE and also turns \x1c to \x1f, which are
+# whitespace to str.split but not to bytes.split, into spaces
+_ASCII_SPACE_TABLE = bytes(ord(' ') if 0x1c <= code <= 0x1f else
+                           _ASCII_TABLE[code] for code in range(256))
+
+
+def _collapse_whitespace(doc):
+    """
+    Returns `doc` with every run of whitespace replaced by a single space,
+    like _WHITESPACE.sub(' ', doc) but quicker. str.split uses the same
+    definition of whitespace as the \\s pattern.
+
+    >>> _collapse_whitespace('\\t a \\n\\n b  ')
+    ' a b '
+    >>> _collapse_whitespace('  ')
+    ' '
+    """
+    collapsed = ' '.join(doc.split())
+    if not collapsed:
+        return ' ' if doc else ''
+    if doc[0].isspace():
+        collapsed = ' ' + collapsed
+    if doc[-1].isspace():
+        collapsed += ' '
+    return collapsed
+
+
+def format_document(doc):
+    """
+    Re-formats `d` by collapsing all whitespace characters into a space and
+    stripping all characters that aren't letters or punctuation.
+
+    Whitespace is collapsed with str.split and then each character is kept
+    or dropped (and lower cased) by one str.translate call using a cached
+    per code point table. A document that is all ASCII is translated as
+    bytes instead, which is quicker still. The result is always identical
+    to reference_format_document's. Collapsing whitespace can't be folded
+    into the translation, since a dropped character between two spaces
+    must still leave both of them.
+
+    >>> format_document('Hello,\\t\\tWorld! (2018) ok')
+    'hello, world!  ok'
+    >>> format_document('\\u00c9t\\u00c9 \\u2014 \\u00e0 Paris.')
+    '\\xe9t\\xe9  \\xe0 paris.'
+    """
+    doc = _collapse_whitespace(doc)
+    if doc.isascii():
+        doc = doc.encode('ascii').translate(_ASCII_TABLE, _ASCII_DELETE)
+        return doc.decode('ascii')
+    return doc.translate(_FORMAT_TABLE)
+
+
+def run_format_trials(filenames=TEST_FILES, repeat=3):
+    """
+    Times format_document against reference_format_document on each file in
+    `filenames`, taking the best of `repeat` runs, and checks that their
+    output is identical.
+    """
+    print('{:>28} {:>10} {:>10} {:>8} {:>6}'.format(
+        'corpus', 'reference', 'fast', 'speedup', 'same'))
+    for corpus_filename in filenames:
+        with open(corpus_filename) as infile:
+            doc = infile.read()
+        timings = []
+        for formatter in (reference_format_document, format_document):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                formatted = formatter(doc)
+                time_taken = time.perf_counter() - start
+                best = time_taken if best is None else min(best, time_taken)
+            timings.append((best, formatted))
+        (slow, expected), (fast, actual) = timings
+        print('{:>28} {:10.4f} {:10.4f} {:7.1f}x {:>6}'.format(
+            corpus_filename, slow, fast, slow / fast, str(actual == expected)))
+
+
+class DocumentNormalizer(object):
+    """
+    Formats a document given in pieces, eg, as it is read from a file,
+    exactly as format_document would format the whole document.
+    A run of whitespace split between pieces still becomes a single space.
+
+    >>> doc = 'The  cat\\n\\n sat.\\t\\tOn the MAT '
+    >>> normalizer = DocumentNormalizer()
+    >>> pieces = [normalizer.feed(doc[i:i + 4]) for i in range(0, 29, 4)]
+    >>> ''.join(pieces) == format_document(doc)
+    True
+    >>> ''.join(pieces)
+    'the cat sat. on the mat '
+    """
+
+    def __init__(self):
+        # Whether the last piece fed ended part way through a whitespace run
+        self.in_whitespace = False
+
+    def feed(self, chunk):
+        """
+        Returns the formatted version of the next piece, `chunk`: a str,
+        or a bytes-like object holding only ASCII, which is formatted
+        without being decoded first.
+        """
+        if not isinstance(chunk, str):
+            return self._feed_ascii(chunk)
+        if self.in_whitespace:
+            chunk = _LEADING_WHITESPACE.sub('', chunk, count=1)
+        if not chunk:
+            return ''
+        self.in_whitespace = _WHITESPACE.match(chunk[-1]) is not None
+        return format_document(chunk)
+
+    def _feed_ascii(self, chunk):
+        # The same steps as format_document, on bytes. bytes.translate
+        # only works on bytes, not on a memoryview, so the piece is copied
+        # once here; the copy takes well under 1% of the time this takes
+        doc = bytes(chunk).translate(_ASCII_SPACE_TABLE)
+        if self.in_whitespace:
+            doc = doc.lstrip()
+        if not doc:
+            return ''
+        self.in_whitespace = doc[-1:].isspace()
+        words = doc.split()
+        if not words:
+            collapsed = b' '
+        else:
+            collapsed = b' '.join(words)
+            if doc[:1].isspace():
+                collapsed = b' ' + collapsed
+            if self.in_whitespace:
+                collapsed += b' '
+        return collapsed.translate(None, _ASCII_DELETE).decode('ascii')
+
+
+class CorpusSource(object):
+    """
+    Reads a UTF-8 corpus file by memory-mapping it, yielding it in pieces
+    of up to `chunk_size` bytes for a DocumentNormalizer to format.
+    Stretches of ASCII are yielded as memoryview slices of the mapping,
+    with no decoding or copying; only stretches holding other characters
+    are decoded, with an incremental decoder so a character split between
+    two pieces is still decoded correctly. A slice is released as soon as
+    the next piece is asked for, so it mustn't be kept.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> filename = os.path.join(directory.name, 'ete.txt')
+    >>> with open(filename, 'wb') as outfile:
+    ...     _ = outfile.write('Summer\\n\\n\\u00e9t\\u00e9 ok'.encode('utf-8'))
+    >>> with CorpusSource(filename, chunk_size=4) as source:
+    ...     print([(type(piece).__name__, len(piece)) for piece in source])
+    [('memoryview', 4), ('memoryview', 4), ('str', 2), ('str', 4)]
+    >>> with CorpusSource(filename) as source:
+    ...     read_formatted(source)
+    'summer \\xe9t\\xe9 ok'
+    >>> directory.cleanup()
+    """
+
+    # A stretch of at least this many ASCII bytes ends a decoded piece
+    ascii_run = 256
+
+    def __init__(self, filename, chunk_size=1 << 16):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        with open(filename, 'rb') as infile:
+            if os.fstat(infile.fileno()).st_size:
+                self._mmap = mmap.mmap(infile.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            else:
+                self._mmap = None
+
+    def __iter__(self):
+        if self._mmap is None:
+            return
+        ascii_run = re.compile(rb'[\x00-\x7f]{%d}' % self.ascii_run)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        data = self._mmap
+        view = memoryview(data)
+        position = 0
+        size = len(data)
+        try:
+            while position < size:
+                stop = min(position + self.chunk_size, size)
+                match = _NON_ASCII.search(data, position, stop)
+                if match is None or match.start() > position:
+                    if match is not None:
+                        stop = match.start()
+                    piece = view[position:stop]
+                    yield piece
+                    piece.release()
+                else:
+                    match = ascii_run.search(data, position, stop)
+                    if match is not None:
+                        stop = match.start()
+                    yield decoder.decode(data[position:stop])
+                position = stop
+            decoder.decode(b'', final=True)
+        finally:
+            view.release()
+
+    def close(self):
+        """Unmaps the file"""
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_formatted(source):
+    """
+    Returns the whole corpus from the CorpusSource `source` formatted as
+    format_document would format it.
+    """
+    normalizer = DocumentNormalizer()
+    return ''.join(normalizer.feed(piece) for piece in source)
+
+
+def confirm(prompt):
+    """
+    Asks the user to confirm a yes/no question.
+    Returns True/False based on their answer.
+    """
+    ans = ' '
+    while ans[0] not in ('Y', 'y', 'n', 'N'):
+        ans = input(prompt + ' (y/n) ')
+    return True if ans[0] in ('Y', 'y') else False
+
+
+def check_guess(next_char, guess):
+    """
+    Returns True if `guess` matches `next_char`, or asks the user if
+    `next_char` is None.
+    """
+    if next_char is not None:
+        return next_char == guess
+    else:
+        return confirm(" '{}'?".format(guess))
+
+
+def next_guess(guesses):
+    """ Returns the next guess """
+    return guesses.pop(0) if len(guesses) else None
 
 
 def check_guesses(next_char, guesses):
@@ -786,32 +3934,43 @@ def guess_next_char(phrase, progress, table, is_auto):
     # set it to None if not doing auto
     next_char = phrase[len(progress)].lower() if is_auto else None
 
-    # Find possible guesses
-    last_two_chars = progress[-2:].lower()
-    guesses = table.fetch(last_two_chars)
-    if guesses is None:
-        guesses = []
-    # Convert guesses into a list
-    guesses = list(guesses)
-
-    fallbacks = fallback_guesses(guesses)
-    fallbacks = list(fallbacks)
+    # Find possible guesses, the corpus ones first and then the fallbacks
+    prefix = progress[-table.prefix_len:].lower()
+    if isinstance(table, GuessIndex):
+        guesses, n_corpus = table.guesses(prefix)
+        if is_auto:
+            # The answer is known, so look up where it is in the guesses
+            guess_count = table.guess_count(prefix, next_char)
+            if guess_count is None or guess_count > n_corpus:
+                print(' Exhausted all guesses from the corpus! '
+                      'Just guessing...')
+            if guess_count is None:
+                print(' Exhaused all fallbacks! Failed to guess phrase.')
+                sys.exit(1)
+            return next_char, guess_count
+    else:
+        guesses, n_corpus = _rank_guesses(table.fetch(prefix))
 
     # Try to guess it from the table
-    (guess, guess_count) = check_guesses(next_char, guesses)
-
-    if guess is None:
-        # If guessing from the corpus failed, try to guess from the
-        # fallbacks
-        print(' Exhausted all guesses from the corpus! Just guessing...')
-        (guess, current_guess_count) = check_guesses(next_char, fallbacks)
-        if guess is None:
-            # If that failed, we're screwed!
-            print(' Exhaused all fallbacks! Failed to guess phrase.')
-            # Give up and exit the program
-            sys.exit(1)
-        guess_count += current_guess_count
-    return guess, guess_count
+    guess_count = 0
+    for guess in guesses[:n_corpus]:
+        guess_count += 1
+        if check_guess(next_char, guess):
+            return guess, guess_count
+
+    # If guessing from the corpus failed, try to guess from the
+    # fallbacks. Running out of corpus guesses counts as a guess.
+    print(' Exhausted all guesses from the corpus! Just guessing...')
+    guess_count += 1
+    for guess in guesses[n_corpus:]:
+        guess_count += 1
+        if check_guess(next_char, guess):
+            return guess, guess_count
+
+    # If that failed, we're screwed!
+    print(' Exhaused all fallbacks! Failed to guess phrase.')
+    # Give up and exit the program
+    sys.exit(1)
 
 
 def play_game(table, phrase, phrase_len=0):
@@ -832,6 +3991,8 @@ def play_game(table, phrase, phrase_len=0):
     Returns the total number of guesses taken and the total time taken
     If in interactive mode the time taken value will be 0.
     """
+    if not isinstance(table, GuessIndex):
+        table = GuessIndex(table)
     start = time.perf_counter()
     # Play the game automatically if phrase_len is 0
     is_auto = phrase_len == 0
@@ -840,7 +4001,9 @@ def play_game(table, phrase, phrase_len=0):
     if is_auto:
         phrase_len = len(phrase)
 
-    progress = phrase[0:2]
+    # Models that look back further than they need to start still start
+    # from seed_len characters
+    progress = phrase[0:table.seed_len]
     gap_line = '_' * (phrase_len - len(progress))
     total_guesses = 0
     print('{}{}  (0)'.format(progress, gap_line))
@@ -861,18 +4024,158 @@ def play_game(table, phrase, phrase_len=0):
     return total_guesses, time_taken
 
 
-def load_corpus_and_play(corpus_filename, phrase, length=0):
-    """ Loads the corpus file and plays the game with the given setttings """
-    with open(corpus_filename) as infile:
-        print('Loading corpus... ' + corpus_filename)
-        corpus = format_document(infile.read())
-        print('Corpus loaded. ({} characters)'.format(len(corpus)))
-        unique_chars = len(set(corpus))
-        table = process_corpus(corpus, unique_chars)
-        # print(table)
+def _score_phrase(table, phrase):
+    """
+    Plays `phrase` against the GuessIndex `table` in auto mode without
+    printing anything and returns the guess count for each character after
+    the given start, or None if a character can't be guessed.
+    """
+    prefix_len = table.prefix_len
+    progress = phrase[0:table.seed_len]
+    counts = []
+    while len(progress) < len(phrase):
+        next_char = phrase[len(progress)].lower()
+        count = table.guess_count(progress[-prefix_len:].lower(), next_char)
+        if count is None:
+            return None
+        progress += next_char
+        counts.append(count)
+    return counts
+
+
+def _score_phrases(table, phrases):
+    """
+    Scores each of `phrases` and returns (totals, counts, offsets) as
+    described in play_games.
+    """
+    totals = array('l')
+    counts = array('I')
+    offsets = array('L', [0])
+    for phrase in phrases:
+        phrase_counts = _score_phrase(table, phrase)
+        if phrase_counts is None:
+            totals.append(-1)
+        else:
+            totals.append(sum(phrase_counts))
+            counts.extend(phrase_counts)
+        offsets.append(len(counts))
+    return totals, counts, offsets
+
+
+def score_phrase(table, phrase):
+    """
+    Returns the total number of guesses play_game(table, phrase) takes,
+    without printing anything, or None if play_game would give up.
+    Each character costs one lookup, so pass a GuessIndex to reuse its
+    work across many calls.
+
+    >>> table = process_corpus('through tough thorough thought though', 7)
+    >>> score_phrase(table, 'though'), score_phrase(table, 'thorn')
+    (4, 19)
+    """
+    if not isinstance(table, GuessIndex):
+        table = GuessIndex(table)
+    counts = _score_phrase(table, phrase)
+    return None if counts is None else sum(counts)
+
+
+# The table each play_games worker process scores against
+_worker_table = None
+
+
+def _init_games_worker(table):
+    global _worker_table
+    _worker_table = table
+
+
+def _score_phrases_in_worker(phrases):
+    return _score_phrases(_worker_table, phrases)
+
+
+def play_games(table, phrases, workers=None, chunk_size=1000):
+    """
+    Plays every phrase in `phrases` against `table` in auto mode, without
+    printing, and returns three arrays (totals, counts, offsets):
+      totals[i] is the total number of guesses for phrases[i], the same as
+      play_game(table, phrases[i]) returns, or -1 if play_game would have
+      given up on it;
+      counts[offsets[i]:offsets[i + 1]] are the guesses taken for each
+      character of phrases[i] after the starting characters (empty for a
+      phrase that was given up on).
+    If `workers` is given, the phrases are split into chunks of
+    `chunk_size` and scored by that many processes.
+
+    >>> table = process_corpus('through tough thorough thought though', 7)
+    >>> totals, counts, offsets = play_games(table, ['though', 'thorn',
+    ...                                              'to\\u00e9'])
+    >>> list(totals)
+    [4, 19, -1]
+    >>> list(counts[offsets[0]:offsets[1]])
+    [1, 1, 1, 1]
+    >>> list(counts[offsets[1]:offsets[2]])
+    [1, 2, 16]
+    """
+    if not isinstance(table, GuessIndex):
+        table = GuessIndex(table)
+    if not workers:
+        return _score_phrases(table, phrases)
+    chunks = [phrases[start:start + chunk_size]
+              for start in range(0, len(phrases), chunk_size)]
+    totals = array('l')
+    counts = array('I')
+    offsets = array('L', [0])
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_games_worker,
+                             initargs=(table,)) as pool:
+        for chunk_totals, chunk_counts, chunk_offsets in pool.map(
+                _score_phrases_in_worker, chunks):
+            totals.extend(chunk_totals)
+            offsets.extend(offset + len(counts)
+                           for offset in chunk_offsets[1:])
+            counts.extend(chunk_counts)
+    return totals, counts, offsets
+
+
+def load_corpus_and_play(corpus_filename, phrase, length=0, stream=False,
+                         model_filename=None, cache=None):
+    """ Loads the corpus file and plays the game with the given setttings.
+    If `stream` is True the corpus is read and processed in chunks rather
+    than all at once, which needs far less memory for a large corpus.
+    If `model_filename` names an existing compiled model it is played
+    against instead of the corpus; if it doesn't exist yet the table built
+    from the corpus is compiled to it for next time.
+    If a ModelCache is given as `cache` the model is taken from it instead.
+    """
+    if cache is not None:
+        print('Loading cached model... ' + corpus_filename)
+        table = cache.load(corpus_filename)
         _, time_taken = play_game(table, phrase, length)
         if length == 0:
             print('Took {:0.6f} seconds'.format(time_taken))
+        return
+    if model_filename is not None and os.path.exists(model_filename):
+        print('Loading model... ' + model_filename)
+        with CompiledModel(model_filename) as table:
+            _, time_taken = play_game(table, phrase, length)
+        if length == 0:
+            print('Took {:0.6f} seconds'.format(time_taken))
+        return
+    print('Loading corpus... ' + corpus_filename)
+    if stream:
+        table, corpus_len = load_corpus_streaming(corpus_filename)
+    else:
+        with CorpusSource(corpus_filename) as source:
+            corpus = read_formatted(source)
+        corpus_len = len(corpus)
+        table = process_corpus(corpus, None, growable=True)
+        del corpus
+    print('Corpus loaded. ({} characters)'.format(corpus_len))
+    if model_filename is not None:
+        compile_table(table, model_filename)
+    # print(table)
+    _, time_taken = play_game(table, phrase, length)
+    if length == 0:
+        print('Took {:0.6f} seconds'.format(time_taken))
 
 
 def main():
@@ -0,0 +1,280 @@
+"""
+A local asyncio server that loads a Shannon's game model once and answers
+requests for it from any number of clients, over TCP or a Unix socket.
+
+The protocol is one UTF-8 request per line and one response per line, in
+the same order:
+
+    PREDICT <k> <context>   the first k guesses (all of them if k is 0) for
+                            the character after <context>, in the order
+                            auto mode would try them:
+                            OK <guesses> as one string of characters
+    PLAY <phrase>           plays <phrase> in auto mode:
+                            OK <total> <guesses for each character>, or
+                            OK -1 if a character can't be guessed
+    STATS                   OK <counters as JSON>
+
+Anything else, or a request that fails, gets ERR <message>, as does a
+line longer than 64 KiB, the rest of which is skipped. Clients may
+pipeline, sending more requests before reading the responses to earlier
+ones. Every complete line read from a connection in one go is answered as
+a batch with a single write, so a pipelining client pays for one round
+trip per batch rather than one per request.
+
+Run it with
+    python shannon_server.py CORPUS_OR_MODEL [--port PORT | --unix PATH]
+and load test it with shannon_client.py.
+"""
+
+import asyncio
+import json
+import time
+
+from shannon_p2 import (CompiledModel, GuessIndex, ModelCache,
+                        _score_phrase)
+
+# Latencies are counted in buckets of powers of two microseconds
+_LATENCY_BUCKETS = 32
+
+# Longest request line read, in bytes; longer ones get ERR and are skipped
+_MAX_LINE = 1 << 16
+
+
+class PredictionServer(object):
+    """
+    Answers protocol lines for `model` (a PrefixTable or anything else with
+    fetch and prefix_len) and keeps the request counters.
+
+    >>> from shannon_p2 import process_corpus
+    >>> server = PredictionServer(process_corpus(
+    ...     'through tough thorough thought though', 7))
+    >>> server.respond('PREDICT 3 Th')
+    'OK ora'
+    >>> server.respond('PLAY thorn')
+    'OK 19 1 2 16'
+    >>> server.respond('PLAY to\\u00e9')
+    'OK -1'
+    >>> server.respond('GUESS th')
+    "ERR unknown command 'GUESS'"
+    >>> server.respond('PREDICT many th')
+    'ERR PREDICT needs a number of guesses'
+    >>> server.respond('PREDICT 3 ')
+    'OK abc'
+    >>> server.stats()['requests']
+    {'PREDICT': 2, 'PLAY': 2, 'ERR': 2}
+
+    Only prefixes the model has are remembered, so clients sending made up
+    contexts can't grow the server's memory.
+
+    >>> _ = server.respond('PREDICT 1 \u4e00\u4e01')
+    >>> server.index.n_cached
+    4
+
+    A line longer than `max_line` is answered as soon as it gets too long,
+    and the rest of it is skipped rather than kept.
+
+    >>> import asyncio
+    >>> class PrintingWriter(object):
+    ...     def write(self, data):
+    ...         print(data)
+    ...     async def drain(self):
+    ...         pass
+    ...     def close(self):
+    ...         pass
+    >>> async def send(data):
+    ...     reader = asyncio.StreamReader()
+    ...     reader.feed_data(data)
+    ...     reader.feed_eof()
+    ...     await server.handle(reader, PrintingWriter(), read_size=8,
+    ...                         max_line=16)
+    >>> asyncio.run(send(b'PREDICT 2 th\\nPLAY ' + b'o' * 40 +
+    ...                  b'\\nPREDICT \\xc2\\xb2 th\\nPREDICT 1 th\\n'))
+    b'OK or\\n'
+    b'ERR line too long\\n'
+    b'ERR PREDICT needs a number of guesses\\n'
+    b'OK o\\n'
+    """
+
+    def __init__(self, model):
+        self.index = GuessIndex(model, cache_unseen=False)
+        self.prefix_len = model.prefix_len
+        self.started = time.perf_counter()
+        self.connections = 0
+        self.batches = 0
+        self.requests = {'PREDICT': 0, 'PLAY': 0, 'STATS': 0, 'ERR': 0}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * _LATENCY_BUCKETS
+
+    def predict(self, k, context):
+        """Returns the first `k` guesses (or all if `k` is 0) after
+        `context` as a string.
+        """
+        prefix = context[-self.prefix_len:].lower()
+        guesses, _ = self.index.guesses(prefix)
+        return ''.join(guesses[:k] if k else guesses)
+
+    def play(self, phrase):
+        """Returns the guess counts for `phrase`, or None if it can't be
+        played.
+        """
+        return _score_phrase(self.index, phrase)
+
+    def respond(self, line):
+        """Returns the response line (without the newline) for `line`"""
+        command, _, argument = line.partition(' ')
+        if command == 'PREDICT':
+            count, _, context = argument.partition(' ')
+            if not count.isdecimal():
+                return self._error('PREDICT needs a number of guesses')
+            self.requests['PREDICT'] += 1
+            return 'OK ' + self.predict(int(count), context)
+        if command == 'PLAY':
+            self.requests['PLAY'] += 1
+            counts = self.play(argument)
+            if counts is None:
+                return 'OK -1'
+            return 'OK ' + ' '.join(map(str, [sum(counts)] + counts))
+        if command == 'STATS':
+            self.requests['STATS'] += 1
+            return 'OK ' + json.dumps(self.stats())
+        return self._error('unknown command {!r}'.format(command))
+
+    def _error(self, message):
+        self.requests['ERR'] += 1
+        return 'ERR ' + message
+
+    def _record_latency(self, seconds, n_requests):
+        self.latency_total += seconds * n_requests
+        self.latency_max = max(self.latency_max, seconds)
+        bucket = min(int(seconds * 1e6).bit_length(), _LATENCY_BUCKETS - 1)
+        self.latency_buckets[bucket] += n_requests
+
+    def _latency_percentile(self, fraction):
+        """Returns the upper bound in seconds of the latency bucket holding
+        the given `fraction` of requests.
+        """
+        target = fraction * sum(self.latency_buckets)
+        seen = 0
+        for bucket, count in enumerate(self.latency_buckets):
+            seen += count
+            if count and seen >= target:
+                return (1 << bucket) / 1e6
+        return 0.0
+
+    def stats(self):
+        """Returns the request counters and latencies as a dict"""
+        n_requests = sum(self.requests.values())
+        uptime = time.perf_counter() - self.started
+        return {'uptime': uptime,
+                'connections': self.connections,
+                'requests': {command: count for command, count
+                             in self.requests.items() if count},
+                'batches': self.batches,
+                'mean_batch': n_requests / self.batches if self.batches
+                              else 0.0,
+                'throughput': n_requests / uptime if uptime else 0.0,
+                'latency_mean': self.latency_total / n_requests
+                                if n_requests else 0.0,
+                'latency_p50': self._latency_percentile(0.5),
+                'latency_p99': self._latency_percentile(0.99),
+                'latency_max': self.latency_max}
+
+    def _answer(self, line, max_line):
+        """Returns the response line for the raw request `line`"""
+        if len(line) > max_line:
+            return self._error('line too long')
+        try:
+            line = line.rstrip(b'\r').decode('utf-8')
+        except UnicodeDecodeError:
+            return self._error('request is not UTF-8')
+        try:
+            return self.respond(line)
+        except Exception as error:
+            # One bad request mustn't lose the rest of the batch
+            return self._error('{}: {}'.format(type(error).__name__, error))
+
+    async def handle(self, reader, writer, read_size=1 << 16,
+                     max_line=_MAX_LINE):
+        """Serves one client connection until it closes"""
+        self.connections += 1
+        pending = b''
+        # Whether the rest of a line that got too long is still to come
+        skipping = False
+        try:
+            while True:
+                data = await reader.read(read_size)
+                if not data:
+                    break
+                received = time.perf_counter()
+                if skipping:
+                    newline = data.find(b'\n')
+                    if newline < 0:
+                        continue
+                    data = data[newline + 1:]
+                    skipping = False
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                responses = [self._answer(line, max_line) for line in lines]
+                if len(pending) > max_line:
+                    responses.append(self._error('line too long'))
+                    pending = b''
+                    skipping = True
+                if not responses:
+                    continue
+                n_requests = len(responses)
+                responses.append('')
+                writer.write('\n'.join(responses).encode('utf-8'))
+                self.batches += 1
+                self._record_latency(time.perf_counter() - received,
+                                     n_requests)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(model, host='127.0.0.1', port=8765, path=None):
+    """
+    Serves `model` on TCP `host`:`port`, or on the Unix socket `path` if
+    one is given, until cancelled.
+    """
+    server = PredictionServer(model)
+    if path is None:
+        listener = await asyncio.start_server(server.handle, host, port)
+    else:
+        listener = await asyncio.start_unix_server(server.handle, path)
+    async with listener:
+        await listener.serve_forever()
+
+
+def load_model(filename):
+    """
+    Returns the model in `filename`: a CompiledModel if it is a compiled
+    model file, otherwise the model built from it as a corpus.
+    """
+    try:
+        return CompiledModel(filename)
+    except ValueError:
+        return ModelCache().load(filename)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('model', help='a corpus or compiled model file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='serve on this Unix socket instead of TCP')
+    args = parser.parse_args()
+    model = load_model(args.model)
+    try:
+        asyncio.run(serve(model, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()